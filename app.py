@@ -1,12 +1,32 @@
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import uuid
+import random
+import threading
+import os
+import json
+import hashlib
+import hmac
+import sqlite3
+import re
+import bisect
+import unicodedata
+import io
+import base64
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 from datetime import datetime, date, timedelta
 # import extra_streamlit_components as stx # ปิดชั่วคราว
 from streamlit_calendar import calendar
 import pytz 
+from dataclasses import dataclass, field
+try:
+    from PIL import Image, ImageOps, features as pil_features
+except ImportError: # ไม่มี Pillow -> อัปโหลดไฟล์เดิมตามเดิม
+    Image = None
 
 # ================= CONFIGURATION =================
 st.set_page_config(page_title="LSX Ranking", page_icon="🏆", layout="wide")
@@ -29,12 +49,448 @@ NEWS_DB_ID = "280e6d24b97d806fa7c8e8bd4ca717f8"
 
 REGISTRATION_DEADLINE = datetime(2026, 1, 18, 23, 59, 59)
 
+DISK_CACHE_PATH = os.environ.get("LSX_CACHE_PATH", os.path.join(".cache", "notion_cache.sqlite3"))
+DISK_CACHE_MAX_STALE = 7 * 24 * 3600 # วินาที: เก่ากว่านี้จะไม่เอามาเสิร์ฟ
+
+NOTION_API_URL = "https://api.notion.com/v1"
+NOTION_TIMEOUT = (5, 30) # (connect, read) วินาที
+NOTION_POOL_SIZE = 16
+NOTION_RATE_LIMIT = 3.0 # requests/วินาที ต่อ integration (เพดานของ Notion)
+NOTION_BURST = 3
+NOTION_MAX_RETRIES = 5
+NOTION_BACKOFF_BASE = 0.5 # วินาที
+NOTION_BACKOFF_CAP = 30.0
+NOTION_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# ลำดับความสำคัญของ request (เลขน้อย = ได้คิวก่อน)
+PRIORITY_INTERACTIVE = 0 # ผู้ใช้รออยู่ เช่น login / สมัคร / แก้ไขข้อมูล
+PRIORITY_BACKGROUND = 1 # โหลด/refresh cache
+
 headers = {
     "Authorization": "Bearer " + NOTION_TOKEN,
     "Content-Type": "application/json",
     "Notion-Version": "2022-06-28"
 }
 
+# ================= NOTION CLIENT =================
+# Streamlit รัน script ใหม่ทุก rerun คลาสนี้จึงถูกสร้างใหม่ทุกครั้ง แต่ client/cache ที่อยู่ใน
+# st.cache_resource ยัง raise คลาสของรอบที่สร้างมันอยู่ ตอนจับ error จึงจับที่
+# requests.RequestException (คลาสแม่ที่ไม่เปลี่ยน) แทน NotionError ตรงๆ
+class NotionError(requests.RequestException):
+    pass
+
+# Token bucket กลางของทั้ง process: ทุก request ต้องขอ token ก่อนยิง
+# request ที่ priority สูงกว่าที่รออยู่จะได้ token ก่อนเสมอ
+class RateScheduler:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiting = [0, 0]
+        self.cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, priority=PRIORITY_BACKGROUND):
+        with self.cond:
+            self.waiting[priority] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    ahead = any(self.waiting[p] for p in range(priority))
+                    if not ahead and now >= self.paused_until and self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = max(self.paused_until - now, (1 - self.tokens) / self.rate, 0.01)
+                    self.cond.wait(wait)
+            finally:
+                self.waiting[priority] -= 1
+                self.cond.notify_all()
+
+    # โดน 429 -> หยุดทั้ง integration ตาม Retry-After ไม่ใช่แค่ request นั้น
+    def pause(self, seconds):
+        with self.cond:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self.cond.notify_all()
+
+def backoff_delay(attempt):
+    # exponential backoff แบบ full jitter
+    return random.uniform(0, min(NOTION_BACKOFF_CAP, NOTION_BACKOFF_BASE * (2 ** attempt)))
+
+def parse_retry_after(res):
+    try: return max(0.0, float(res.headers.get("Retry-After")))
+    except (TypeError, ValueError): return None
+
+# ใช้ Session เดียว (keep-alive + connection pool) แทน requests.get/post ทุกครั้ง
+# เพื่อไม่ต้อง handshake TCP+TLS ใหม่กับ api.notion.com ทุก request
+class NotionClient:
+    def __init__(self, request_headers):
+        self.session = requests.Session()
+        self.session.headers.update(request_headers)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=NOTION_POOL_SIZE)
+        self.session.mount("https://", adapter)
+        self.scheduler = RateScheduler(NOTION_RATE_LIMIT, NOTION_BURST)
+
+    def request(self, method, path, priority=PRIORITY_BACKGROUND, **kwargs):
+        kwargs.setdefault("timeout", NOTION_TIMEOUT)
+        url = f"{NOTION_API_URL}/{path}"
+        # สร้าง page (POST /pages) ห้าม retry เมื่อ error ที่ไม่แน่ใจว่าถึง server แล้วหรือยัง ไม่งั้นได้ page ซ้ำ
+        # ส่วน 429 retry ได้เสมอเพราะ Notion ปฏิเสธ request นั้นไปแล้ว
+        idempotent = method != "POST" or path.endswith("/query") or path == "search"
+        for attempt in range(NOTION_MAX_RETRIES + 1):
+            self.scheduler.acquire(priority)
+            try:
+                res = self.session.request(method, url, **kwargs)
+            except requests.RequestException as e:
+                if not idempotent or attempt == NOTION_MAX_RETRIES: raise NotionError(f"{method} {path}: {e}") from e
+                time.sleep(backoff_delay(attempt))
+                continue
+            retryable = res.status_code == 429 or (idempotent and res.status_code in NOTION_RETRY_STATUS)
+            if not retryable or attempt == NOTION_MAX_RETRIES:
+                return res
+            delay = parse_retry_after(res)
+            if delay is None: delay = backoff_delay(attempt)
+            if res.status_code == 429: self.scheduler.pause(delay)
+            else: time.sleep(delay)
+        return res
+
+    def get(self, path, **kwargs): return self.request("GET", path, **kwargs)
+    def post(self, path, **kwargs): return self.request("POST", path, **kwargs)
+    def patch(self, path, **kwargs): return self.request("PATCH", path, **kwargs)
+
+    # query หน้าเดียว คืน response ทั้งก้อน (results / has_more / next_cursor)
+    def query(self, database_id, payload=None, priority=PRIORITY_BACKGROUND):
+        res = self.post(f"databases/{database_id}/query", json=payload or {}, priority=priority)
+        if res.status_code != 200:
+            raise NotionError(f"query {database_id}: HTTP {res.status_code}")
+        return res.json()
+
+    # ดึงทุกหน้าของ database query; ถ้าหน้าไหนพังจะ raise แทนการคืนผลแค่ครึ่งเดียว
+    def query_all(self, database_id, payload=None, priority=PRIORITY_BACKGROUND):
+        payload = dict(payload or {})
+        payload.setdefault("page_size", 100)
+        results = []
+        while True:
+            data = self.query(database_id, payload, priority)
+            results.extend(data.get("results", []))
+            if not data.get("has_more"): return results
+            payload["start_cursor"] = data.get("next_cursor")
+
+# สร้างครั้งเดียวต่อ process ใช้ร่วมกันทุก rerun / ทุก session
+@st.cache_resource(show_spinner=False)
+def get_notion_client():
+    return NotionClient(headers)
+
+# ================= DISK CACHE =================
+# cache ชั้นที่ 2 (SQLite) อยู่หลัง cache ในหน่วยความจำ เก็บผล query ไว้ข้าม restart/redeploy
+# key = database_id + payload ที่ใช้ query
+class DiskCache:
+    def __init__(self, path):
+        folder = os.path.dirname(path)
+        if folder: os.makedirs(folder, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, database_id TEXT NOT NULL, value TEXT NOT NULL, stored_at REAL NOT NULL)")
+        self.conn.commit()
+        self.lock = threading.Lock()
+        self.served = set() # key ที่ process นี้เสิร์ฟไปแล้วอย่างน้อย 1 ครั้ง
+        self.refreshing = set()
+        self.on_done = {} # key -> callback ที่ต้องเรียกหลัง revalidate สำเร็จ
+        self.invalidated = {} # database_id -> เวลาที่ตรวจพบว่ามีการแก้ไข (entry ที่เก่ากว่านี้ถือว่าหมดอายุ)
+
+    @staticmethod
+    def make_key(database_id, payload):
+        raw = json.dumps(payload or {}, sort_keys=True, ensure_ascii=False)
+        return f"{database_id}:{hashlib.sha1(raw.encode('utf-8')).hexdigest()}"
+
+    def get(self, key):
+        try:
+            with self.lock:
+                row = self.conn.execute("SELECT value, stored_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row: return json.loads(row[0]), row[1]
+        except (sqlite3.Error, ValueError) as e:
+            print(f"⚠️ disk cache read {key}: {e}")
+        return None
+
+    def put(self, key, database_id, value):
+        try:
+            data = json.dumps(value, ensure_ascii=False)
+            with self.lock:
+                self.conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", (key, database_id, data, time.time()))
+                self.conn.commit()
+        except (sqlite3.Error, TypeError) as e:
+            print(f"⚠️ disk cache write {key}: {e}")
+
+    # entry ของ database นี้ที่เก็บก่อนหน้านี้ไม่นับว่า fresh อีก (แต่ยังใช้เป็นค่าสำรองตอน Notion พังได้)
+    def invalidate(self, database_id):
+        with self.lock: self.invalidated[database_id] = time.time()
+
+    # True ครั้งแรกที่ key นี้ถูกขอใน process นี้ (เพิ่งเปิดเครื่อง)
+    def first_use(self, key):
+        with self.lock:
+            if key in self.served: return False
+            self.served.add(key)
+            return True
+
+    def is_refreshing(self, key):
+        with self.lock: return key in self.refreshing
+
+    # refresh เบื้องหลังแบบ single-flight ต่อ key สำเร็จแล้วเรียก on_done (เช่นบอก SWR ให้โหลดค่าใหม่)
+    def revalidate(self, key, fetch, on_done=None):
+        with self.lock:
+            if on_done: self.on_done.setdefault(key, []).append(on_done)
+            if key in self.refreshing: return
+            self.refreshing.add(key)
+        def run():
+            done = False
+            try:
+                fetch()
+                done = True
+            except Exception as e: print(f"⚠️ revalidate {key}: {e}")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+                    callbacks = self.on_done.pop(key, [])
+            if done:
+                for callback in callbacks: callback()
+        threading.Thread(target=run, daemon=True).start()
+
+@st.cache_resource(show_spinner=False)
+def get_disk_cache():
+    return DiskCache(DISK_CACHE_PATH)
+
+# fresh -> ใช้เลย / stale ตอนเพิ่งเปิดเครื่อง -> เสิร์ฟค่าเก่าแล้ว refresh เบื้องหลัง
+# (SWR นับอายุค่านั้นจากตอนที่เก็บลง disk และโหลดใหม่ทันทีที่ refresh เสร็จ)
+# stale ระหว่างใช้งานปกติ -> ดึงใหม่ ถ้า Notion พังค่อยใช้ค่าเก่า
+def disk_cached(key, database_id, fetch, ttl):
+    disk = get_disk_cache()
+    def fetch_and_store():
+        value = fetch()
+        disk.put(key, database_id, value)
+        return value
+
+    first_use = disk.first_use(key)
+    entry = disk.get(key)
+    if entry:
+        value, stored_at = entry
+        age = time.time() - stored_at
+        if age < ttl and stored_at >= disk.invalidated.get(database_id, 0): return value
+        if age < DISK_CACHE_MAX_STALE:
+            if first_use or disk.is_refreshing(key):
+                swr = get_swr_cache()
+                swr_key = swr.note_stale(stored_at)
+                disk.revalidate(key, fetch_and_store, (lambda: swr.invalidate(swr_key)) if swr_key is not None else None)
+                return value
+            try: return fetch_and_store()
+            except requests.RequestException as e:
+                print(f"⚠️ serving stale {key}: {e}")
+                return value
+    return fetch_and_store()
+
+def cached_query(database_id, payload=None, ttl=300, priority=PRIORITY_BACKGROUND):
+    notion = get_notion_client()
+    return disk_cached(DiskCache.make_key(database_id, payload), database_id, lambda: notion.query_all(database_id, payload, priority), ttl)
+
+# ================= STALE-WHILE-REVALIDATE =================
+# cache ในหน่วยความจำร่วมกันทุก session: หมดอายุแล้วยังคืนค่าเดิมทันที
+# แล้ว refresh ใน worker thread ครั้งเดียวต่อ key (single-flight) ไม่ให้ทุก session ยิง API พร้อมกัน
+# ปกติ key จะถูก refresh เพราะ ChangeWatcher เจอการแก้ไขใน Notion TTL เป็นแค่ตาข่ายกันพลาด
+SWR_TTL = 1800 # วินาที
+RANKING_KEY = "ranking"
+PROJECT_KEY = "project"
+NEWS_KEY = "news"
+CALENDAR_KEY = "calendar" # key จริงเป็น (CALENDAR_KEY, เดือน)
+
+class SWRCache:
+    def __init__(self):
+        self.entries = {} # key -> (value, fetched_at)
+        self.inflight = {} # key -> Future
+        self.loaders = {} # key -> loader ล่าสุด (ใช้ตอน invalidate)
+        self.expired = {} # key -> เวลาที่ถูก invalidate
+        self.local = threading.local() # key ที่ loader ใน thread นี้กำลังโหลด + อายุของค่าเก่าที่ได้มา
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="swr-refresh")
+
+    def _load(self, key, loader):
+        started = time.time()
+        self.local.key, self.local.stale_at = key, None
+        try:
+            value = loader()
+            with self.lock:
+                # loader ได้ค่าเก่าจาก disk มา -> นับอายุจากตอนที่ค่านั้นถูกเก็บ ไม่ใช่ตอนนี้
+                self.entries[key] = (value, self.local.stale_at or time.time())
+                # ถ้าถูก invalidate ระหว่างโหลด ค่าที่ได้อาจเก่าไปแล้ว ให้ยังถือว่าหมดอายุ
+                if self.expired.get(key, started) < started: del self.expired[key]
+            return value
+        except Exception as e:
+            print(f"⚠️ refresh {key}: {e}")
+            raise
+        finally:
+            self.local.key = None
+            with self.lock: self.inflight.pop(key, None)
+
+    # เรียกจากใน loader: ค่าที่กำลังคืนเป็นค่าเก่าที่เก็บไว้ตั้งแต่ stored_at
+    # คืน key ที่กำลังโหลด (None ถ้าไม่ได้ถูกเรียกจาก loader ของ SWR)
+    def note_stale(self, stored_at):
+        key = getattr(self.local, "key", None)
+        if key is not None: self.local.stale_at = min(self.local.stale_at or stored_at, stored_at)
+        return key
+
+    # ต้องถือ lock อยู่ตอนเรียก
+    def _start(self, key, loader):
+        future = self.inflight.get(key)
+        if future is None:
+            future = self.inflight[key] = self.executor.submit(self._load, key, loader)
+        return future
+
+    def get(self, key, loader, ttl=SWR_TTL):
+        with self.lock:
+            self.loaders[key] = loader
+            entry = self.entries.get(key)
+            if entry is not None:
+                if key in self.expired or time.time() - entry[1] >= ttl: self._start(key, loader)
+                return entry
+            # ยังไม่มีค่าเลย ต้องรอ แต่ทุก session รอ future ตัวเดียวกัน
+            future = self._start(key, loader)
+        future.result()
+        with self.lock: return self.entries[key]
+
+    def age(self, key):
+        with self.lock: entry = self.entries.get(key)
+        return time.time() - entry[1] if entry else None
+
+    def is_refreshing(self, key):
+        with self.lock: return key in self.inflight
+
+    def keys(self):
+        with self.lock: return list(self.entries)
+
+    def is_expired(self, key):
+        with self.lock: return key in self.expired
+
+    # ข้อมูลต้นทางเปลี่ยน: refresh ทันทีเบื้องหลัง ระหว่างนั้นยังเสิร์ฟค่าเดิม
+    def invalidate(self, key):
+        with self.lock:
+            if key not in self.entries: return
+            self.expired[key] = time.time()
+            loader = self.loaders.get(key)
+            if loader: self._start(key, loader)
+
+@st.cache_resource(show_spinner=False)
+def get_swr_cache():
+    return SWRCache()
+
+def swr_get(key, loader, default_factory, ttl=SWR_TTL):
+    get_change_watcher().touch()
+    try: return get_swr_cache().get(key, loader, ttl)[0]
+    except requests.RequestException as e:
+        print(f"⚠️ {key}: {e}")
+        return default_factory()
+
+# ================= CHANGE DETECTION =================
+# แทนการรอ TTL: thread เบื้องหลังถาม Notion ว่าอะไรถูกแก้ไขล่าสุด (search เรียงตาม last_edited_time
+# ขอแค่ 1 รายการ = 1 request ต่อรอบ) ถ้าใหม่กว่าที่เคยเห็น ค่อยเช็ค database ที่ดูอยู่ทีละตัว
+# แล้วล้างเฉพาะ cache ที่เกี่ยวข้อง (SWR key + entry บน disk) poll เฉพาะตอนมีคนเปิดแอปอยู่
+CHANGE_POLL_INTERVAL = 60 # วินาที
+CHANGE_IDLE_AFTER = 600 # ไม่มีใครเปิดแอปนานเท่านี้ หยุด poll (เปิดครั้งถัดไปค่อยเริ่มใหม่)
+# last_edited_time ของ Notion ปัดเป็นนาที ค่าเท่าเดิมแต่ยังใหม่อยู่ อาจมีการแก้ไขเพิ่มในนาทีเดียวกัน
+# จึงถือว่าอาจเปลี่ยนและล้าง cache ซ้ำจนกว่าจะพ้นช่วงนี้ (1 นาทีของค่า + เผื่อ)
+CHANGE_RECENT_WINDOW = 120
+
+def notion_id(value):
+    return (value or "").replace("-", "")
+
+class ChangeWatcher:
+    def __init__(self, notion, disk, swr):
+        self.notion, self.disk, self.swr = notion, disk, swr
+        self.handlers = {} # database_id -> [callable] เรียกเมื่อ database นั้นเปลี่ยน
+        self.dynamic = [] # (ฟังก์ชันคืนชุด database_id, callable) สำหรับ database ที่รู้ตอน runtime
+        self.marks = {} # database_id -> last_edited_time ล่าสุดที่เห็น
+        self.latest = None # last_edited_time ล่าสุดของทั้ง workspace (จาก search)
+        self.checked_at = None # poll สำเร็จล่าสุด
+        self.last_seen = 0.0
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def watch(self, database_id, handler):
+        self.handlers.setdefault(database_id, []).append(handler)
+
+    def watch_dynamic(self, sources, handler):
+        self.dynamic.append((sources, handler))
+
+    @staticmethod
+    def _recent(mark):
+        edited = parse_notion_time(mark)
+        return edited is not None and time.time() - edited < CHANGE_RECENT_WINDOW
+
+    def checked_age(self):
+        return time.time() - self.checked_at if self.checked_at else None
+
+    def touch(self):
+        with self.lock:
+            self.last_seen = time.time()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, daemon=True, name="change-watcher")
+                self.thread.start()
+
+    def _run(self):
+        while time.time() - self.last_seen < CHANGE_IDLE_AFTER:
+            try: self.poll()
+            except requests.RequestException as e: print(f"⚠️ change poll: {e}")
+            time.sleep(CHANGE_POLL_INTERVAL)
+
+    def _watched(self):
+        watched = { db_id: list(handlers) for db_id, handlers in self.handlers.items() }
+        for sources, handler in self.dynamic:
+            try: ids = sources()
+            except requests.RequestException: continue
+            for db_id in ids: watched.setdefault(db_id, []).append(handler)
+        return watched
+
+    def poll(self):
+        payload = { "sort": { "direction": "descending", "timestamp": "last_edited_time" }, "page_size": 1 }
+        res = self.notion.post("search", json=payload)
+        if res.status_code != 200: raise NotionError(f"search: HTTP {res.status_code}")
+        results = res.json().get("results", [])
+        latest = results[0]["last_edited_time"] if results else None
+        if latest != self.latest or self._recent(latest):
+            watched = self._watched()
+            changed = set()
+            # schema ของ database เปลี่ยน (เช่นเพิ่มตัวเลือกจังหวัด) ไม่ขยับ last_edited_time ของ page
+            if self.latest is not None and results and results[0]["object"] == "database":
+                changed.add(notion_id(results[0]["id"]))
+            for db_id in watched:
+                mark = get_latest_edit_time(db_id, self.notion)
+                if db_id in self.marks and (mark != self.marks[db_id] or self._recent(mark)): changed.add(db_id)
+                self.marks[db_id] = mark
+            self.latest = latest
+            for db_id in changed & set(watched):
+                self.disk.invalidate(db_id)
+                for handler in watched[db_id]: handler()
+        self.checked_at = time.time()
+
+@st.cache_resource(show_spinner=False)
+def get_change_watcher():
+    swr = get_swr_cache()
+    watcher = ChangeWatcher(get_notion_client(), get_disk_cache(), swr)
+    def member_changed():
+        get_member_db_schema.clear()
+        get_province_options.clear()
+        swr.invalidate(RANKING_KEY)
+    watcher.watch(MEMBER_DB_ID, member_changed)
+    watcher.watch_dynamic(get_rollup_sources, lambda: swr.invalidate(RANKING_KEY))
+    def project_changed():
+        for key in swr.keys():
+            if key == PROJECT_KEY or (isinstance(key, tuple) and key[0] == CALENDAR_KEY): swr.invalidate(key)
+    watcher.watch(PROJECT_DB_ID, project_changed)
+    watcher.watch(NEWS_DB_ID, lambda: swr.invalidate(NEWS_KEY))
+    return watcher
+
 # ================= HELPER FUNCTIONS =================
 
 def extract_numeric(prop):
@@ -46,427 +502,1032 @@ def extract_numeric(prop):
     elif p_type == 'formula': val = prop.get('formula', {}).get('number')
     return val if val is not None else 0
 
-@st.cache_data(show_spinner=False)
-def get_page_title(page_id):
-    url = f"https://api.notion.com/v1/pages/{page_id}"
-    try:
-        res = requests.get(url, headers=headers)
-        if res.status_code == 200:
-            data = res.json()
-            for key, prop_val in data["properties"].items():
-                if prop_val["type"] == "title" and prop_val["title"]:
-                    return prop_val["title"][0]["text"]["content"]
-        return "-"
-    except: return "-"
+def extract_page_title(page):
+    for key, prop_val in page.get("properties", {}).items():
+        if prop_val["type"] == "title" and prop_val["title"]:
+            return prop_val["title"][0]["text"]["content"]
+    return "-"
+
+# LRU + TTL: จำกัดจำนวน entry ไม่ให้โตไปเรื่อยๆ และให้ชื่อที่ถูกแก้ใน Notion ถูกดึงใหม่
+TITLE_CACHE_SIZE = 5000
+TITLE_CACHE_TTL = 3600 # วินาที
+
+class TitleCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.items = OrderedDict() # page_id -> (title, stored_at)
+
+    def get(self, key):
+        entry = self.items.get(key)
+        if entry is None: return None
+        if time.time() - entry[1] >= self.ttl:
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, title):
+        self.items[key] = (title, time.time())
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize: self.items.popitem(last=False)
+
+# map page_id -> ชื่อ ใช้ร่วมกันทุก session; id ที่ยังไม่มีจะถูกดึงพร้อมกันหลาย thread
+# (ยังผ่าน RateScheduler ตัวเดียวกัน จึงไม่เกิน rate limit)
+TITLE_FETCH_WORKERS = 8
+TITLE_WARM_RETRY = 60 # วินาที: warm ไม่สำเร็จให้รอก่อนลองใหม่ ไม่ให้ทุกหน้าโปรไฟล์ scan ซ้ำ
+HISTORY_RELATIONS = ["สถิติการลง Rank ทั้งหมด", "สถิติการลง Rank Junior ทั้งหมด"]
+
+class TitleResolver:
+    def __init__(self):
+        self.cache = TitleCache(TITLE_CACHE_SIZE, TITLE_CACHE_TTL)
+        self.lock = threading.Lock()
+        self.warm_lock = threading.Lock()
+        self.warmed_at = {} # database_id -> เวลา warm ล่าสุด
+        self.failed_at = {} # database_id -> เวลาที่ warm ไม่สำเร็จล่าสุด
+        self.executor = ThreadPoolExecutor(max_workers=TITLE_FETCH_WORKERS, thread_name_prefix="title-fetch")
+
+    def _fetch(self, notion, page_id):
+        try:
+            res = notion.get(f"pages/{page_id}", priority=PRIORITY_INTERACTIVE)
+            if res.status_code == 200: return extract_page_title(res.json())
+        except requests.RequestException: pass
+        return None
+
+    # โหลดชื่อทั้ง database ด้วย query แบบแบ่งหน้าครั้งเดียว แทนการ GET ทีละ page
+    def warm(self, database_id):
+        with self.warm_lock:
+            if time.time() - self.warmed_at.get(database_id, 0) < TITLE_CACHE_TTL: return
+            if time.time() - self.failed_at.get(database_id, 0) < TITLE_WARM_RETRY: return
+            try:
+                if database_id == PROJECT_DB_ID:
+                    titles = [(r.id, r.title or "-") for r in get_project_snapshot()]
+                else:
+                    titles = [(p["id"], extract_page_title(p)) for p in cached_query(database_id, ttl=TITLE_CACHE_TTL, priority=PRIORITY_INTERACTIVE)]
+            except requests.RequestException as e:
+                print(f"⚠️ warm titles {database_id}: {e}")
+                self.failed_at[database_id] = time.time()
+                return
+            with self.lock:
+                for page_id, title in titles: self.cache.put(page_id, title)
+            self.warmed_at[database_id] = time.time()
+
+    def resolve(self, page_ids, notion):
+        with self.lock: found = { i: self.cache.get(i) for i in dict.fromkeys(page_ids) }
+        missing = [i for i, t in found.items() if t is None]
+        if missing:
+            # รอผลครบก่อนค่อยจับ lock ไม่ให้ session อื่นที่มีชื่อใน cache แล้วต้องรอ network
+            fetched = list(zip(missing, self.executor.map(lambda i: self._fetch(notion, i), missing)))
+            with self.lock:
+                for page_id, title in fetched:
+                    if title is not None:
+                        self.cache.put(page_id, title)
+                        found[page_id] = title
+        return { i: found.get(i) or "-" for i in page_ids }
+
+# database ปลายทางของ relation ประวัติการลง Rank (ถ้าหาไม่เจอใช้ PROJECT_DB_ID)
+def get_history_databases():
+    try: schema = get_member_db_schema()
+    except requests.RequestException: schema = {}
+    db_ids = { schema[n]["relation"]["database_id"] for n in HISTORY_RELATIONS if schema.get(n, {}).get("type") == "relation" }
+    return db_ids or { PROJECT_DB_ID }
+
+@st.cache_resource(show_spinner=False)
+def get_title_resolver():
+    return TitleResolver()
+
+def resolve_page_titles(page_ids):
+    resolver = get_title_resolver()
+    for db_id in get_history_databases(): resolver.warm(db_id)
+    return resolver.resolve(page_ids, get_notion_client())
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_member_db_schema():
+    res = get_notion_client().get(f"databases/{MEMBER_DB_ID}")
+    if res.status_code != 200: raise NotionError(f"member schema: HTTP {res.status_code}")
+    return res.json().get("properties", {})
 
 @st.cache_data(ttl=3600)
 def get_province_options():
-    url = f"https://api.notion.com/v1/databases/{MEMBER_DB_ID}"
     try:
-        res = requests.get(url, headers=headers)
-        if res.status_code == 200:
-            props = res.json().get("properties", {})
-            if "มาจากจังหวัด" in props:
-                options = props["มาจากจังหวัด"].get("multi_select", {}).get("options", [])
-                return [o["name"] for o in options]
+        props = get_member_db_schema()
+        if "มาจากจังหวัด" in props:
+            options = props["มาจากจังหวัด"].get("multi_select", {}).get("options", [])
+            return [o["name"] for o in options]
     except: pass
     return []
 
-@st.cache_data(ttl=300)
-def get_latest_news(limit=5, category_filter=None):
-    url = f"https://api.notion.com/v1/databases/{NEWS_DB_ID}/query"
-    payload = {
-        "page_size": limit, 
-        "sorts": [ { "property": "วันที่ประกาศ", "direction": "descending" } ]
-    }
-    if category_filter:
-        payload["filter"] = {"property": "ประเภท", "select": {"equals": category_filter}}
+# database ที่คะแนน/อันดับของสมาชิกถูก rollup มา
+def get_rollup_sources():
+    schema = get_member_db_schema()
+    relation_names = { p.get("rollup", {}).get("relation_property_name") for p in schema.values() if p.get("type") == "rollup" }
+    return { schema[n]["relation"]["database_id"] for n in relation_names if n in schema and schema[n].get("type") == "relation" }
+
+# เวลาแก้ไขล่าสุดของทั้ง database (ถามแค่ 1 แถว เรียงตาม last_edited_time)
+def get_latest_edit_time(database_id, notion=None):
+    notion = notion or get_notion_client()
+    payload = { "page_size": 1, "sorts": [ { "timestamp": "last_edited_time", "direction": "descending" } ] }
+    res = notion.post(f"databases/{database_id}/query", json=payload)
+    if res.status_code != 200: raise NotionError(f"latest edit {database_id}: HTTP {res.status_code}")
+    results = res.json().get("results", [])
+    return results[0]["last_edited_time"] if results else None
+
+# ---------- NEWS DB: store เดียวใช้ร่วมกันทุกหน้า (dashboard / ข่าวสาร / กฎระเบียบ) ----------
+# ดึงทั้ง DB ครั้งเดียวต่อรอบ refresh เรียงวันที่ใหม่ -> เก่า แยก index ตามประเภท
+# แต่ละหน้าขอเป็นช่วง (cursor = ตำแหน่งเริ่ม) จึงเห็นข้อมูลชุดเดียวกันเสมอ
+# รายการต้องใช้เนื้อหาทำตัวอย่าง (preview) จึงตัดเนื้อหาออกจาก query ด้วย filter_properties ไม่ได้
+# เนื้อหาเต็มมากับผล query อยู่แล้ว เก็บไว้ในแต่ละข่าวเลย popup ไม่ต้องถาม Notion ซ้ำ
+NEWS_PAGE_SIZE = 20
+NEWS_PREVIEW_CHARS = 200
+NEWS_CACHE_TTL = 300
+
+@dataclass(frozen=True)
+class NewsPage:
+    items: tuple = ()
+    next_cursor: int = None # None = หน้าสุดท้าย
+
+@dataclass(frozen=True)
+class NewsStore:
+    items: tuple = ()
+    by_category: dict = field(default_factory=dict) # ประเภท -> tuple ของข่าว (เรียงเหมือน items)
+
+    def page(self, category_filter=None, cursor=0, size=NEWS_PAGE_SIZE):
+        items = self.by_category.get(category_filter, ()) if category_filter else self.items
+        end = cursor + size
+        return NewsPage(items[cursor:end], end if end < len(items) else None)
+
+def get_news_store():
+    return swr_get(NEWS_KEY, fetch_news_store, NewsStore)
+
+def get_news_page(category_filter=None, cursor=None):
+    return get_news_store().page(category_filter, cursor or 0)
+
+def fetch_news_store():
+    payload = { "sorts": [ { "property": "วันที่ประกาศ", "direction": "descending" } ] }
+    items = tuple(parse_news_header(page) for page in cached_query(NEWS_DB_ID, payload, ttl=NEWS_CACHE_TTL))
+    by_category = defaultdict(list)
+    for item in items: by_category[item["category"]].append(item)
+    get_news_media().prefetch(items, get_notion_client())
+    return NewsStore(items, { cat: tuple(news) for cat, news in by_category.items() })
+
+def parse_news_content(props):
+    content = "-"
+    try: 
+        content_list = props.get("เนื้อหา", {}).get("rich_text", [])
+        content = "".join([t["text"]["content"] for t in content_list])
+    except: pass
+    return content
 
-    news_list = []
+def parse_news_header(page):
+    props = page.get("properties", {})
+    
+    topic = "ไม่มีหัวข้อ"
+    try: topic = props.get("หัวข้อ", {}).get("title", [])[0]["text"]["content"]
+    except: pass
+    
+    category = "ข่าวสาร"
     try:
-        res = requests.post(url, json=payload, headers=headers)
-        if res.status_code == 200:
-            data = res.json()
-            for page in data.get("results", []):
-                props = page.get("properties", {})
-                
-                topic = "ไม่มีหัวข้อ"
-                try: topic = props.get("หัวข้อ", {}).get("title", [])[0]["text"]["content"]
-                except: pass
-                
-                category = "ข่าวสาร"
-                try:
-                    cat_prop = props.get("ประเภท")
-                    if cat_prop['type'] == 'select' and cat_prop['select']:
-                        category = cat_prop['select']['name']
-                    elif cat_prop['type'] == 'multi_select' and cat_prop['multi_select']:
-                        category = cat_prop['multi_select'][0]['name']
-                except: pass
+        cat_prop = props.get("ประเภท")
+        if cat_prop['type'] == 'select' and cat_prop['select']:
+            category = cat_prop['select']['name']
+        elif cat_prop['type'] == 'multi_select' and cat_prop['multi_select']:
+            category = cat_prop['multi_select'][0]['name']
+    except: pass
 
-                if category_filter and category_filter != category: continue
+    content = parse_news_content(props)
+    preview = (content[:NEWS_PREVIEW_CHARS] + '...') if len(content) > NEWS_PREVIEW_CHARS else content
+    
+    link = None
+    try: link = props.get("URL", {}).get("url")
+    except: pass
+    
+    show_date = "ไม่ระบุวันที่"
+    try: 
+        d_str = props.get("วันที่ประกาศ", {}).get("date", {}).get("start")
+        if d_str:
+            d_obj = datetime.strptime(d_str, "%Y-%m-%d")
+            show_date = d_obj.strftime("%d/%m/%Y")
+    except: pass
 
-                content = "-"
-                try: 
-                    content_list = props.get("เนื้อหา", {}).get("rich_text", [])
-                    content = "".join([t["text"]["content"] for t in content_list])
-                except: pass
-                
-                link = None
-                try: link = props.get("URL", {}).get("url")
-                except: pass
-                
-                show_date = "ไม่ระบุวันที่"
-                try: 
-                    d_str = props.get("วันที่ประกาศ", {}).get("date", {}).get("start")
-                    if d_str:
-                        d_obj = datetime.strptime(d_str, "%Y-%m-%d")
-                        show_date = d_obj.strftime("%d/%m/%Y")
-                except: pass
+    image_urls, image_keys, image_expiry = parse_news_images(props)
+    return { 
+        "id": page["id"], "topic": topic, "preview": preview, 
+        "url": link, "date": show_date, "category": category, "content": content,
+        "image_urls": image_urls, "image_keys": image_keys, "image_expiry": image_expiry
+    }
 
-                image_urls = []
-                try:
-                    img_files = props.get("ภาพประกอบ", {}).get("files", [])
-                    for file in img_files:
-                        url = ""
-                        if file['type'] == 'external': url = file['external']['url']
-                        elif file['type'] == 'file': url = file['file']['url']
-                        if url: image_urls.append(url)
-                except: pass
-                
-                news_list.append({ 
-                    "id": page["id"], "topic": topic, "content": content, 
-                    "url": link, "date": show_date, "category": category, "image_urls": image_urls
-                })
+# คืน (รายการ URL รูป, key ของแต่ละรูป, เวลาหมดอายุที่เร็วที่สุดของ URL ไฟล์ใน Notion เป็น epoch หรือ None)
+# ไฟล์ที่อัปโหลดเข้า Notion (type "file") เป็น signed URL อายุประมาณ 1 ชม. query เปลี่ยนทุกครั้งแต่ path เดิม จึงใช้ path เป็น key
+# ลิงก์ภายนอกใช้ URL เต็ม (เช่น Google Drive แยกไฟล์ด้วย query ?id=)
+def parse_news_images(props):
+    image_urls, image_keys, expiry = [], [], None
+    try:
+        img_files = props.get("ภาพประกอบ", {}).get("files", [])
+        for file in img_files:
+            url = key = ""
+            if file['type'] == 'external': url = key = file['external']['url']
+            elif file['type'] == 'file':
+                url = file['file']['url']
+                key = url.split("?", 1)[0]
+                expires = parse_notion_time(file['file'].get('expiry_time'))
+                if expires and (expiry is None or expires < expiry): expiry = expires
+            if url:
+                image_urls.append(url)
+                image_keys.append(key)
+    except: pass
+    return image_urls, image_keys, expiry
+
+def parse_notion_time(value):
+    if not value: return None
+    try: return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except ValueError: return None
+
+# ---------- PROJECT DB: snapshot เดียว ใช้ร่วมกันทั้ง แกลเลอรี / กิจกรรมถัดไป ----------
+# แปลงวันที่ใน Notion ครั้งเดียวตอน parse: start/end เป็น datetime แบบมี timezone (THAI_TZ)
+# end เป็นแบบ exclusive (งานทั้งวัน = เที่ยงคืนของวันถัดจากวันสุดท้าย) งานหลายวันจึงคิดช่วงได้ตรง
+@dataclass(frozen=True)
+class EventRecord:
+    id: str
+    title: str
+    event_type: str
+    date_raw: str # ค่าดิบจาก Notion ใช้แสดงเมื่อแปลงไม่ได้
+    start: datetime # None ถ้าไม่มีวันที่หรือแปลงไม่ได้
+    end: datetime
+    all_day: bool
+    url: str
+    details: str
+    photo_url: str
+
+    @property
+    def event_date(self):
+        return self.start.date() if self.start else None
+
+    # วันสุดท้ายของงาน (นับรวมวันนั้น)
+    @property
+    def last_date(self):
+        return max(self.end - timedelta(microseconds=1), self.start).date() if self.start else None
+
+    @property
+    def duration(self):
+        return self.end - self.start if self.start else None
+
+    def format_date(self, fmt="%d/%m/%Y"):
+        if not self.start: return self.date_raw or "" # ถ้าแปลงไม่ได้จริงๆ ให้โชว์ค่าเดิมไปเลย
+        text = self.start.strftime(fmt)
+        if not self.all_day: text += self.start.strftime(" %H:%M")
+        if self.last_date != self.event_date:
+            text += " - " + self.last_date.strftime(fmt)
+            if not self.all_day: text += self.end.strftime(" %H:%M")
+        elif not self.all_day and self.end > self.start: text += self.end.strftime("-%H:%M")
+        return text
+
+    @property
+    def date_display(self):
+        return self.format_date()
+
+# คืน (datetime ใน THAI_TZ, เป็นงานทั้งวันหรือไม่) / (None, True) ถ้าแปลงไม่ได้
+def parse_notion_date(value, time_zone=None):
+    if not value: return None, True
+    try:
+        if "T" not in value:
+            d = date.fromisoformat(value)
+            return THAI_TZ.localize(datetime(d.year, d.month, d.day)), True
+        dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        # ไม่มี offset มากับค่า แต่ Notion บอก time_zone แยกไว้
+        if dt.tzinfo is None: dt = pytz.timezone(time_zone or "Asia/Bangkok").localize(dt)
+        return dt.astimezone(THAI_TZ), False
+    except (ValueError, pytz.UnknownTimeZoneError): return None, True
+
+def parse_event_record(page):
+    props = page.get('properties', {})
+
+    title = ""
+    if "ชื่อกิจกรรม" in props:
+        try: title = props["ชื่อกิจกรรม"]["title"][0]["text"]["content"]
+        except: pass
+
+    event_type = "ทั่วไป"
+    if 'ประเภทงาน' in props:
+        pt = props['ประเภทงาน']
+        if pt['type'] == 'select' and pt['select']: event_type = pt['select']['name']
+        elif pt['type'] == 'multi_select' and pt['multi_select']: event_type = pt['multi_select'][0]['name']
+
+    date_raw = None; start = end = None; all_day = True
+    if "วันที่จัดกิจกรรม" in props:
+        d_obj = props["วันที่จัดกิจกรรม"].get("date")
+        if d_obj:
+            date_raw = d_obj.get("start")
+            start, all_day = parse_notion_date(date_raw, d_obj.get("time_zone"))
+            end, _ = parse_notion_date(d_obj.get("end"), d_obj.get("time_zone"))
+    if start:
+        # end ของงานทั้งวันใน Notion นับรวมวันสุดท้าย -> เลื่อนเป็นเที่ยงคืนของวันถัดไป
+        if all_day: end = max(end or start, start) + timedelta(days=1)
+        else: end = max(end or start, start)
+
+    event_url = None
+    if "URL" in props:
+        event_url = props["URL"].get("url")
+
+    details_text = "-"
+    try:
+        d_list = props.get("รายละเอียดเพิ่มเติม", {}).get("rich_text", [])
+        details_text = "".join([t["text"]["content"] for t in d_list])
     except: pass
-    return news_list
 
-@st.cache_data(ttl=300)
+    photo_url = None
+    if "Photo URL" in props:
+        photo_url = props["Photo URL"].get("url")
+        # เผื่อกรณีเป็น Text ไม่ใช่ URL
+        if not photo_url and props["Photo URL"].get("type") == "rich_text":
+            try: photo_url = props["Photo URL"]["rich_text"][0]["text"]["content"]
+            except: pass
+
+    return EventRecord(page["id"], title, event_type, date_raw, start, end, all_day, event_url, details_text, photo_url)
+
+# ดึงทั้ง database ครั้งเดียวต่อ TTL (เรียงวันที่ใหม่ -> เก่า) แล้ว parse เป็น EventRecord
+def get_project_snapshot():
+    return swr_get(PROJECT_KEY, fetch_project_snapshot, tuple)
+
+def fetch_project_snapshot():
+    payload = { "sorts": [ { "property": "วันที่จัดกิจกรรม", "direction": "descending" } ] }
+    return tuple(parse_event_record(page) for page in cached_query(PROJECT_DB_ID, payload, ttl=300))
+
 def get_photo_gallery():
-    gallery_items = []
-    url = f"https://api.notion.com/v1/databases/{PROJECT_DB_ID}/query"
-    
-    # เพิ่ม Pagination เพื่อให้ดึงรูปได้ครบทุกรูป (ถ้าเกิน 100 รูป)
-    has_more = True
-    next_cursor = None
-    
-    while has_more:
-        payload = { 
-            "page_size": 100, 
-            "sorts": [ { "property": "วันที่จัดกิจกรรม", "direction": "descending" } ] 
-        }
-        if next_cursor: payload["start_cursor"] = next_cursor
-        
-        try:
-            res = requests.post(url, json=payload, headers=headers)
-            if res.status_code == 200:
-                data = res.json()
-                for page in data.get("results", []):
-                    props = page.get('properties', {})
-                    
-                    # 1. ดึง Photo URL
-                    photo_url = None
-                    if "Photo URL" in props:
-                        photo_url = props["Photo URL"].get("url")
-                        # เผื่อกรณีเป็น Text ไม่ใช่ URL
-                        if not photo_url and props["Photo URL"].get("type") == "rich_text":
-                             try: photo_url = props["Photo URL"]["rich_text"][0]["text"]["content"]
-                             except: pass
-
-                    # 2. ถ้ามี URL ให้ประมวลผลต่อ
-                    if photo_url:
-                        title = "กิจกรรม (ไม่ระบุชื่อ)"
-                        if "ชื่อกิจกรรม" in props:
-                            try: title = props["ชื่อกิจกรรม"]["title"][0]["text"]["content"]
-                            except: pass
-                        
-                        date_str = ""
-                        if "วันที่จัดกิจกรรม" in props:
-                            d_obj = props["วันที่จัดกิจกรรม"].get("date")
-                            if d_obj:
-                                d_start = d_obj.get("start")
-                                if d_start:
-                                    # ลองแปลงวันที่ (รองรับทั้งแบบมีเวลา และไม่มีเวลา)
-                                    try:
-                                        # ถ้ามี T (มีเวลา) ให้ตัดทิ้งเอาแค่วันที่ข้างหน้า
-                                        if "T" in d_start:
-                                            d_start = d_start.split("T")[0]
-                                            
-                                        date_obj = datetime.strptime(d_start, "%Y-%m-%d")
-                                        date_str = date_obj.strftime("%d/%m/%Y")
-                                    except:
-                                        date_str = d_start # ถ้าแปลงไม่ได้จริงๆ ให้โชว์ค่าเดิมไปเลย
-
-                        # ✅ จุดแก้ไขสำคัญ: ย้าย append ออกมาอยู่ระดับนอกสุดของ if photo_url
-                        # เพื่อให้มั่นใจว่าถูกเพิ่มเข้า List เสมอ ไม่ว่าจะแปลงวันที่สำเร็จหรือไม่
-                        gallery_items.append({
-                            "title": title, 
-                            "date_str": date_str, 
-                            "photo_url": photo_url
-                        })
-                
-                has_more = data.get("has_more", False)
-                next_cursor = data.get("next_cursor")
-            else: break
-        except Exception as e:
-            break
-            
-    return gallery_items
-	
-# 🔥 [UPDATED] ดึงข้อมูลปฏิทิน (เพิ่มการดึงรายละเอียดเพิ่มเติม)
-@st.cache_data(ttl=300)
-def get_calendar_events():
-    events = []
-    target_start = date(2025, 1, 1) 
-    target_end = date(2026, 12, 31)
-    
-    url = f"https://api.notion.com/v1/databases/{PROJECT_DB_ID}/query"
-    has_more = True; next_cursor = None
-    
-    while has_more:
-        payload = { "page_size": 100 }
-        if next_cursor: payload["start_cursor"] = next_cursor
-        
-        try:
-            res = requests.post(url, json=payload, headers=headers)
-            if res.status_code != 200: break
-            
-            data = res.json()
-            for page in data.get("results", []):
-                props = page.get('properties', {})
-                
-                title = "กิจกรรม"
-                if "ชื่อกิจกรรม" in props:
-                    t_list = props["ชื่อกิจกรรม"].get("title", [])
-                    if t_list: title = t_list[0]["text"]["content"]
-                
-                event_type = "ทั่วไป"
-                if 'ประเภทงาน' in props:
-                    pt = props['ประเภทงาน']
-                    if pt['type'] == 'select' and pt['select']: event_type = pt['select']['name']
-                    elif pt['type'] == 'multi_select' and pt['multi_select']: event_type = pt['multi_select'][0]['name']
-                
-                event_date_str = None
-                if "วันที่จัดกิจกรรม" in props:
-                    event_date_str = props["วันที่จัดกิจกรรม"].get("date", {}).get("start")
-                
-                event_url = "#"
-                if "URL" in props:
-                    event_url = props["URL"].get("url", "#")
-                
-                # ✅ 1. ดึงรายละเอียดเพิ่มเติม
-                details_text = "-"
-                try:
-                    d_list = props.get("รายละเอียดเพิ่มเติม", {}).get("rich_text", [])
-                    details_text = "".join([t["text"]["content"] for t in d_list])
-                except: pass
+    return [
+        { "title": r.title or "กิจกรรม (ไม่ระบุชื่อ)", "date_str": r.date_display, "photo_url": r.photo_url }
+        for r in get_project_snapshot() if r.photo_url
+    ]
+
+# ---------- ปฏิทิน: ดึงเฉพาะเดือนที่กำลังดู (ส่ง date filter ไปให้ Notion) ----------
+# cache แยกทีละเดือน เลื่อนเดือนไปมาจึงโหลดเฉพาะเดือนที่ยังไม่เคยดู
+CALENDAR_GRID_DAYS = 42 # dayGridMonth แสดง 6 สัปดาห์ (เริ่มวันอาทิตย์)
+
+def next_month(month):
+    return (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def prev_month(month):
+    return (month - timedelta(days=1)).replace(day=1)
+
+# ช่วงวันที่ที่ตารางเดือนแสดงจริง (รวมวันท้าย/ต้นเดือนข้างเคียง) คืน [start, end)
+def calendar_range(month):
+    start = month - timedelta(days=(month.weekday() + 1) % 7)
+    return start, start + timedelta(days=CALENDAR_GRID_DAYS)
+
+def get_month_events(month):
+    loader = lambda: fetch_month_events(month)
+    return swr_get((CALENDAR_KEY, month.isoformat()), loader, tuple)
 
-                if event_date_str:
-                    try:
-                        e_date = datetime.strptime(event_date_str, "%Y-%m-%d").date()
-                        if target_start <= e_date <= target_end:
-                            bg_color = "#FF4B4B" 
-                            if "งานย่อย" in str(event_type): bg_color = "#708090"
-                            elif "งานใหญ่" in str(event_type): bg_color = "#FFD700"
-                            
-                            events.append({
-                                "title": f"[{event_type}] {title}", 
-                                "start": event_date_str,
-                                "backgroundColor": bg_color, 
-                                "borderColor": bg_color, 
-                                "allDay": True,
-                                "extendedProps": { "url": event_url, "details": details_text }
-                            })
-                    except: pass
+def fetch_month_events(month):
+    payload = {
+        "filter": { "and": [
+            { "property": "วันที่จัดกิจกรรม", "date": { "on_or_after": month.isoformat() } },
+            { "property": "วันที่จัดกิจกรรม", "date": { "before": next_month(month).isoformat() } }
+        ] },
+        "sorts": [ { "property": "วันที่จัดกิจกรรม", "direction": "ascending" } ]
+    }
+    return tuple(parse_event_record(page) for page in cached_query(PROJECT_DB_ID, payload, ttl=300))
+
+def get_calendar_events(start, end):
+    events = []
+    # bucket แบ่งตามวันเริ่มงาน โหลดย้อนไปอีก 1 เดือนเพื่อให้งานหลายวันที่เริ่มก่อนช่วงนี้ยังแสดงได้
+    month = prev_month(start.replace(day=1))
+    while month < end:
+        for r in get_month_events(month):
+            # งานหลายวันแสดงถ้าช่วงของงานทับกับช่วงที่ปฏิทินแสดงอยู่
+            if not (r.start and r.event_date < end and r.last_date >= start): continue
+            bg_color = "#FF4B4B" 
+            if "งานย่อย" in str(r.event_type): bg_color = "#708090"
+            elif "งานใหญ่" in str(r.event_type): bg_color = "#FFD700"
             
-            has_more = data.get("has_more", False)
-            next_cursor = data.get("next_cursor")
-        except: break
+            events.append({
+                "title": f"[{r.event_type}] {r.title or 'กิจกรรม'}", 
+                "start": r.start.date().isoformat() if r.all_day else r.start.isoformat(),
+                "end": r.end.date().isoformat() if r.all_day else r.end.isoformat(),
+                "backgroundColor": bg_color, 
+                "borderColor": bg_color, 
+                "allDay": r.all_day,
+                "extendedProps": { "url": r.url or "#", "details": r.details }
+            })
+        month = next_month(month)
     return events
 
-# 🔥 [UPDATED] ดึงกิจกรรมถัดไป (แก้ไขให้ยืดหยุ่นเรื่องวันที่)
-@st.cache_data(ttl=300)
+# งานที่ยังไม่จบ (รวมงานที่กำลังจัดอยู่) ที่เริ่มเร็วที่สุด เทียบเวลาแบบมี timezone จึงไม่เพี้ยนบน Cloud
 def get_upcoming_event():
-    url = f"https://api.notion.com/v1/databases/{PROJECT_DB_ID}/query"
-    
-    # 💡 ใช้ Buffer ย้อนหลัง 7 วัน เพื่อแก้ปัญหา Timezone บน Cloud
-    # ถ้า event มีวันนี้ แต่วันนี้บน Cloud ยังไม่ถึง (หรือเลยไปแล้วนิดหน่อย) ก็จะยังดึงมาได้
-    buffer_date = (get_thai_date() - timedelta(days=7)).strftime("%Y-%m-%d")
-    
-    payload = {
-        "filter": { "property": "วันที่จัดกิจกรรม", "date": { "on_or_after": buffer_date } },
-        "sorts": [ { "property": "วันที่จัดกิจกรรม", "direction": "ascending" } ],
-        "page_size": 20 # ดึงมาเผื่อเลือก
+    now = datetime.now(THAI_TZ)
+    upcoming = [r for r in get_project_snapshot() if r.start and r.end > now]
+    if not upcoming: return None
+    r = min(upcoming, key=lambda x: x.start)
+    return {
+        "title": r.title or "กิจกรรม", 
+        "date": r.format_date("%d %b %Y"), 
+        "days_left": (r.event_date - now.date()).days,
+        "type": r.event_type, 
+        "url": r.url or "", 
+        "details": r.details
     }
-    
-    try:
-        res = requests.post(url, json=payload, headers=headers)
-        if res.status_code == 200:
-            data = res.json()
-            if data.get("results"):
-                # วนลูปหาอันแรกที่ยังไม่ผ่านไปนานเกินไป หรือยังไม่ปิดรับสมัคร
-                # (Logic: เลือกอันแรกสุดที่ API ส่งมา เพราะเรียงตามวันที่แล้ว)
-                page = data["results"][0]
-                props = page.get('properties', {})
-                
-                title = "กิจกรรม"
-                if "ชื่อกิจกรรม" in props:
-                    t_list = props["ชื่อกิจกรรม"].get("title", [])
-                    if t_list: title = t_list[0]["text"]["content"]
-                
-                d_str = None
-                if "วันที่จัดกิจกรรม" in props:
-                    d_str = props["วันที่จัดกิจกรรม"].get("date", {}).get("start")
-                
-                event_type = "ทั่วไป"
-                if 'ประเภทงาน' in props:
-                    pt = props['ประเภทงาน']
-                    if pt['type'] == 'select' and pt['select']: event_type = pt['select']['name']
-                    elif pt['type'] == 'multi_select' and pt['multi_select']: event_type = pt['multi_select'][0]['name']
-                
-                event_url = ""
-                if "URL" in props:
-                    event_url = props["URL"].get("url", "")
-
-                # ✅ 2. ดึงรายละเอียดเพิ่มเติม
-                details_text = "-"
-                try:
-                    d_list = props.get("รายละเอียดเพิ่มเติม", {}).get("rich_text", [])
-                    details_text = "".join([t["text"]["content"] for t in d_list])
-                except: pass
 
-                return {
-                    "title": title, 
-                    "date": d_str, 
-                    "type": event_type, 
-                    "url": event_url, 
-                    "details": details_text
-                }
-        else:
-            print(f"Error fetching event: {res.status_code}")
-    except Exception as e:
-        print(f"Exception: {e}")
-        pass
-    return None
+# ลำดับ field ของแถวสมาชิก (parse_member_row คืน tuple ตามลำดับนี้)
+MEMBER_COLUMNS = ("id", "name", "photo", "group", "title", "province", "age", "score", "rank_num", "score_jr", "rank_jr_num")
+
+def int_column(values, dtype, default):
+    return pd.Series(values, dtype="float64").fillna(default).astype(dtype)
+
+# คะแนนเป็นจำนวนเต็มเกือบทั้งหมด ใช้ int32 ถ้าได้ ไม่งั้น float32
+def score_column(values):
+    col = pd.Series(values, dtype="float64").fillna(0)
+    return col.astype("int32") if (col % 1 == 0).all() else col.astype("float32")
+
+# สร้าง DataFrame ทีละคอลัมน์ด้วย dtype ขนาดเล็ก (ไม่ผ่าน list ของ dict)
+def build_member_table(rows):
+    cols = dict(zip(MEMBER_COLUMNS, zip(*rows))) if rows else { c: () for c in MEMBER_COLUMNS }
+    return pd.DataFrame({
+        "id": pd.Series(cols["id"], dtype="object"),
+        "name": pd.Series(cols["name"], dtype="object"),
+        "photo": pd.Series(cols["photo"], dtype="object"),
+        "group": pd.Series(cols["group"], dtype="category"),
+        "title": pd.Series(cols["title"], dtype="category"),
+        "province": pd.Series(cols["province"], dtype="category"),
+        "age": int_column(cols["age"], "int16", 99),
+        "score": score_column(cols["score"]),
+        "rank_num": int_column(cols["rank_num"], "int32", 9999),
+        "score_jr": score_column(cols["score_jr"]),
+        "rank_jr_num": int_column(cols["rank_jr_num"], "int32", 9999),
+    })
+
+# ---------- MEMBER DB: sync แบบ incremental ----------
+MEMBER_FULL_SYNC_INTERVAL = 1800 # วินาที: ดึงใหม่ทั้งหมดเป็นระยะ เพื่อเก็บแถวที่ถูกลบ/archive
+LOGIN_RECHECK_INTERVAL = 60 # วินาที: รหัสไม่ตรงกับ index ให้ถาม Notion ซ้ำได้ไม่เกินครั้งละ username ต่อช่วงนี้
+
+def parse_member_row(page):
+    props = page["properties"]
+    
+    name = ""
+    try: name = props.get("ชื่อ", {}).get("title", [])[0]["text"]["content"]
+    except: pass
 
-@st.cache_data(ttl=300)
-def get_ranking_dataframe():
-    url = f"https://api.notion.com/v1/databases/{MEMBER_DB_ID}/query"
-    members = []
-    has_more = True; next_cursor = None
+    photo_url = None
+    try: photo_url = props.get("Photo", {}).get("files", [])[0]["external"]["url"]
+    except: pass
     
-    while has_more:
-        payload = { "page_size": 100 }
-        if next_cursor: payload["start_cursor"] = next_cursor
-        try:
-            res = requests.post(url, json=payload, headers=headers).json()
-            for page in res.get("results", []):
-                props = page["properties"]
-                
-                name = ""
-                try: name = props.get("ชื่อ", {}).get("title", [])[0]["text"]["content"]
-                except: pass
+    group = "-"
+    try: group = props.get("Rank Season 2 Group", {}).get("formula", {}).get("string") or "-"
+    except: pass
+    
+    title = "-"
+    try: title = props.get("Rank Season 2", {}).get("formula", {}).get("string") or "-"
+    except: pass
 
-                photo_url = None
-                try: photo_url = props.get("Photo", {}).get("files", [])[0]["external"]["url"]
-                except: pass
-                
-                group = "-"
-                try: group = props.get("Rank Season 2 Group", {}).get("formula", {}).get("string") or "-"
-                except: pass
-                
-                title = "-"
-                try: title = props.get("Rank Season 2", {}).get("formula", {}).get("string") or "-"
-                except: pass
+    province = None
+    try: province = props["มาจากจังหวัด"]["multi_select"][0]["name"]
+    except: pass
 
-                age = 99 
-                if "อายุ" in props:
-                    age = extract_numeric(props["อายุ"])
-                    if age == 0: age = 99 
-
-                score = extract_numeric(props.get("คะแนน Rank SS2"))
-                rank_val = 9999
-                try:
-                    r_list = props.get("อันดับ Rank SS2", {}).get("rich_text", [])
-                    if r_list:
-                        r_text = r_list[0]["text"]["content"]
-                        if "/" in r_text: rank_val = int(r_text.split('/')[0])
-                        else: rank_val = int(r_text)
-                except: pass
+    age = 99 
+    if "อายุ" in props:
+        age = extract_numeric(props["อายุ"])
+        if age == 0: age = 99 
 
-                score_jr = extract_numeric(props.get("คะแนน Rank SS2 Junior"))
-                rank_jr_val = 9999
-                try:
-                    r_jr_list = props.get("อันดับ Rank SS2 Junior", {}).get("rich_text", [])
-                    if r_jr_list:
-                        r_text = r_jr_list[0]["text"]["content"]
-                        if "/" in r_text: rank_jr_val = int(r_text.split('/')[0])
-                        else: rank_jr_val = int(r_text)
-                except: pass
+    score = extract_numeric(props.get("คะแนน Rank SS2"))
+    rank_val = 9999
+    try:
+        r_list = props.get("อันดับ Rank SS2", {}).get("rich_text", [])
+        if r_list:
+            r_text = r_list[0]["text"]["content"]
+            if "/" in r_text: rank_val = int(r_text.split('/')[0])
+            else: rank_val = int(r_text)
+    except: pass
 
-                members.append({ 
-                    "id": page["id"], 
-                    "name": name, 
-                    "photo": photo_url, 
-                    "group": group, 
-                    "title": title,
-                    "age": age,
-                    "score": score, 
-                    "rank_num": rank_val,
-                    "score_jr": score_jr,
-                    "rank_jr_num": rank_jr_val
-                })
-            has_more = res.get("has_more", False)
-            next_cursor = res.get("next_cursor")
-        except: break
-    
-    if not members: 
-        return pd.DataFrame(columns=['id','name','photo','score','rank_num','score_jr','rank_jr_num','age','อันดับ','อันดับ Junior'])
-    
-    df = pd.DataFrame(members)
-    
-    df['score'] = pd.to_numeric(df['score'], errors='coerce').fillna(0)
-    df['rank_num'] = pd.to_numeric(df['rank_num'], errors='coerce').fillna(9999)
-    df['score_jr'] = pd.to_numeric(df['score_jr'], errors='coerce').fillna(0)
-    df['rank_jr_num'] = pd.to_numeric(df['rank_jr_num'], errors='coerce').fillna(9999)
-    df['age'] = pd.to_numeric(df['age'], errors='coerce').fillna(99)
-    
-    df['อันดับ'] = df['rank_num'] 
-    df['อันดับ Junior'] = df['rank_jr_num']
-    
-    return df
+    score_jr = extract_numeric(props.get("คะแนน Rank SS2 Junior"))
+    rank_jr_val = 9999
+    try:
+        r_jr_list = props.get("อันดับ Rank SS2 Junior", {}).get("rich_text", [])
+        if r_jr_list:
+            r_text = r_jr_list[0]["text"]["content"]
+            if "/" in r_text: rank_jr_val = int(r_text.split('/')[0])
+            else: rank_jr_val = int(r_text)
+    except: pass
+
+    return (page["id"], name, photo_url, group, title, province, age, score, rank_val, score_jr, rank_jr_val)
+
+# ดัชนี login ในหน่วยความจำ: username -> (salt, hash ของรหัสผ่าน, page_id)
+# เก็บเฉพาะ hash แบบมี salt ต่อคน และเก็บ page (ตัด Password ออก) ไว้คืนตอน login สำเร็จ
+# ไม่ถูกเขียนลง disk
+class CredentialIndex:
+    def __init__(self):
+        self.entries = {} # username -> (salt, digest, page_id)
+        self.usernames = {} # page_id -> username
+        self.pages = {} # page_id -> page ที่ไม่มี Password
+        self.rechecked = {} # username -> เวลาที่ถาม Notion ครั้งล่าสุดเพราะรหัสไม่ตรง
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _digest(password, salt):
+        return hashlib.blake2b(password.encode("utf-8"), salt=salt, digest_size=32).digest()
+
+    def _remove(self, page_id):
+        username = self.usernames.pop(page_id, None)
+        if username: self.entries.pop(username, None)
+        self.pages.pop(page_id, None)
+
+    def put(self, page):
+        props = page.get("properties", {})
+        try: username = props["username"]["formula"]["string"]
+        except (KeyError, TypeError): username = None
+        try: password = "".join(t["text"]["content"] for t in props["Password"]["rich_text"])
+        except (KeyError, TypeError): password = ""
+        salt = os.urandom(16)
+        stripped = dict(page, properties={ k: v for k, v in props.items() if k != "Password" })
+        with self.lock:
+            self._remove(page["id"])
+            self.pages[page["id"]] = stripped
+            if username:
+                self.entries[username] = (salt, self._digest(password, salt), page["id"])
+                self.usernames[page["id"]] = username
+
+    # username ที่มีอยู่ใน index รหัสผิดไม่ต้องถาม Notion ทุกครั้ง (เปลี่ยนรหัสจากที่อื่นให้ถามได้เป็นระยะ)
+    def should_recheck(self, username):
+        with self.lock:
+            if username not in self.entries: return True
+            now = time.time()
+            if now - self.rechecked.get(username, 0.0) < LOGIN_RECHECK_INTERVAL: return False
+            self.rechecked[username] = now
+            return True
+
+    # คืน page ของสมาชิก (ใส่ Password ที่พิมพ์มากลับเข้าไป) หรือ None ถ้าไม่ตรง
+    def verify(self, username, password):
+        with self.lock:
+            entry = self.entries.get(username)
+            page = self.pages.get(entry[2]) if entry else None
+        if page is None: return None
+        salt, digest, _ = entry
+        if not hmac.compare_digest(self._digest(password, salt), digest): return None
+        props = dict(page["properties"])
+        props["Password"] = { "type": "rich_text", "rich_text": [{ "type": "text", "text": { "content": password }, "plain_text": password }] }
+        return dict(page, properties=props)
+
+# เก็บแถวล่าสุดของสมาชิกไว้ใน process ตอน refresh ดึงเฉพาะ page ที่ last_edited_time
+# ใหม่กว่า high-water mark ของรอบก่อน แล้ว merge เข้าไป
+# state ถูกเก็บลง disk cache ด้วย (เฉพาะแถวที่ parse แล้ว ไม่มี Password/Email)
+MEMBER_SYNC_KEY = f"{MEMBER_DB_ID}:member_sync_v3"
+
+class MemberSync:
+    def __init__(self, disk):
+        self.disk = disk
+        self.rows = {} # page_id -> tuple ตาม MEMBER_COLUMNS
+        self.high_water = None # last_edited_time สูงสุดที่เคยเห็น
+        self.source_marks = {} # database_id ต้นทางของ rollup -> last_edited_time
+        self.last_full_sync = 0.0
+        self.version = 0 # เพิ่มขึ้นทุกครั้งที่ sync สำเร็จ
+        self.credentials = CredentialIndex() # อยู่ในหน่วยความจำเท่านั้น เริ่มใหม่ทุกครั้งที่เปิดเครื่อง
+        self.credentials_built = False # index login ยังไม่เคยสร้างจาก full sync ใน process นี้
+        self.restored_at = None # เวลาที่ state ที่โหลดมาจาก disk ถูกเก็บ (None = sync ใน process นี้แล้ว)
+        self.lock = threading.Lock()
+        entry = disk.get(MEMBER_SYNC_KEY)
+        if entry and time.time() - entry[1] < DISK_CACHE_MAX_STALE:
+            state = entry[0]
+            self.rows = state["rows"]
+            self.high_water = state["high_water"]
+            self.source_marks = state["source_marks"]
+            self.last_full_sync = state["last_full_sync"]
+            if self.rows: self.restored_at = entry[1]
+
+    def _save(self):
+        state = { "rows": self.rows, "high_water": self.high_water, "source_marks": self.source_marks, "last_full_sync": self.last_full_sync }
+        self.disk.put(MEMBER_SYNC_KEY, MEMBER_DB_ID, state)
+
+    # คะแนน/อันดับเป็น rollup จาก database อื่น ถ้า record ฝั่งนั้นแก้ไข
+    # last_edited_time ของหน้าสมาชิกจะไม่ขยับ จึงต้องเช็ค database ต้นทางด้วย
+    def _source_marks(self, notion):
+        return { db_id: get_latest_edit_time(db_id, notion) for db_id in get_rollup_sources() }
+
+    # เพิ่งเปิดเครื่อง: เสิร์ฟอันดับล่าสุดจาก disk ทันที แล้วค่อย sync เบื้องหลัง
+    # sync เสร็จแล้วสั่ง SWR โหลด snapshot ใหม่ ระหว่างนั้นอายุ snapshot นับจากตอนที่ state ถูกเก็บ
+    def refresh(self, notion):
+        if self.restored_at is not None:
+            swr = get_swr_cache()
+            swr_key = swr.note_stale(self.restored_at)
+            self.disk.revalidate(MEMBER_SYNC_KEY, lambda: self.sync(notion), (lambda: swr.invalidate(swr_key)) if swr_key is not None else None)
+            if self.disk.is_refreshing(MEMBER_SYNC_KEY): return self.version, list(self.rows.values())
+        return self.sync(notion)
+
+    def sync(self, notion):
+        with self.lock:
+            # อ่าน mark ของ database ต้นทางก่อน scan เพื่อให้การแก้ไขระหว่าง scan ถูกจับได้ในรอบถัดไป
+            marks = self._source_marks(notion)
+            full_sync = (not self.credentials_built or self.high_water is None or marks != self.source_marks
+                         or time.time() - self.last_full_sync >= MEMBER_FULL_SYNC_INTERVAL)
+            if full_sync:
+                pages = notion.query_all(MEMBER_DB_ID)
+                rows = { p["id"]: parse_member_row(p) for p in pages }
+                credentials = CredentialIndex()
+                for p in pages: credentials.put(p)
+                self.credentials = credentials
+                self.credentials_built = True
+                self.last_full_sync = time.time()
+            else:
+                # last_edited_time ปัดเป็นนาที ใช้ on_or_after จึงดึงซ้ำนาทีเดิมได้ ไม่ตกหล่น
+                payload = { "filter": { "timestamp": "last_edited_time", "last_edited_time": { "on_or_after": self.high_water } } }
+                pages = notion.query_all(MEMBER_DB_ID, payload)
+                # query ไม่คืน page ที่ถูกลบ/archive แถวเหล่านั้นจึงหายไปได้แค่ตอน full sync เท่านั้น
+                rows = dict(self.rows)
+                for p in pages:
+                    rows[p["id"]] = parse_member_row(p)
+                    self.credentials.put(p)
+            edited = [p["last_edited_time"] for p in pages if p.get("last_edited_time")]
+            if self.high_water: edited.append(self.high_water)
+            self.rows = rows
+            self.source_marks = marks
+            self.high_water = max(edited) if edited else None
+            self.version += 1
+            self.restored_at = None
+            self._save()
+            return self.version, list(rows.values())
+
+@st.cache_resource(show_spinner=False)
+def get_member_sync():
+    return MemberSync(get_disk_cache())
+
+# ---------- snapshot ตารางสมาชิก: 1 ชุดต่อ process ใช้ร่วมกันทุก session ----------
+# อยู่ใน SWR cache (st.cache_resource) จึงไม่ถูก pickle/copy ทุก rerun แบบ st.cache_data
+# ทุกคอลัมน์ถูกล็อกเป็น read-only และ refresh จะสร้าง snapshot ใหม่แล้วสลับทั้งก้อน
+TOP_N = 10
+JUNIOR_MAX_AGE = 13
+
+# สร้าง DataFrame ใหม่จาก array ที่ล็อกไม่ให้เขียน (session ไหนเผลอแก้ค่าจะ error แทนการแก้ข้อมูลของคนอื่น)
+def freeze_frame(df):
+    cols = {}
+    for name in df.columns:
+        col = df[name]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            cols[name] = col.array
+        else:
+            arr = col.to_numpy(copy=True)
+            arr.flags.writeable = False
+            cols[name] = arr
+    return pd.DataFrame(cols, copy=False)
+
+@dataclass(frozen=True)
+class RankingViews:
+    normal: pd.DataFrame # อันดับ Rank SS2 (น้อย->มาก), ชื่อ (ก->ฮ)
+    junior: pd.DataFrame # อายุ <= 13, คะแนน Junior (มาก->น้อย), ชื่อ (ก->ฮ)
+    top_normal: pd.DataFrame
+    top_junior: pd.DataFrame
+
+    @property
+    def empty(self):
+        return self.normal.empty
+
+def build_ranking_views(df):
+    normal = freeze_frame(df.sort_values(by=["rank_num", "name"], ascending=[True, True]))
+    junior = freeze_frame(df[df['age'] <= JUNIOR_MAX_AGE].sort_values(by=["score_jr", "name"], ascending=[False, True]))
+    return RankingViews(normal, junior, normal.head(TOP_N), junior.head(TOP_N))
+
+# ---------- ดัชนีค้นหาชื่อผู้เล่น (สร้างครั้งเดียวต่อ snapshot) ----------
+ZERO_WIDTH_CHARS = dict.fromkeys(map(ord, "\u200b\u200c\u200d\ufeff"), None)
+THAI_TONE_MARKS = re.compile("[\u0e48-\u0e4c]") # ไม้เอก-ไม้จัตวา, การันต์ (พิมพ์ผิดบ่อย ไม่ใช้เทียบ)
+
+def normalize_name(text):
+    text = unicodedata.normalize("NFKC", text or "").translate(ZERO_WIDTH_CHARS)
+    text = THAI_TONE_MARKS.sub("", text.casefold())
+    # NFKC แยก "ำ" เป็น "ํ"+"า" ให้รวมกลับ และ "เเ" (เ สองตัว) ที่พิมพ์แทน "แ"
+    text = text.replace("\u0e4d\u0e32", "\u0e33").replace("\u0e40\u0e40", "\u0e41")
+    return " ".join(text.split())
+
+# คีย์เช็คชื่อซ้ำตอนสมัคร: เข้มกว่า normalize_name (ไม่ตัดวรรณยุกต์ เพราะ "ไก่" กับ "ไก" เป็นคนละชื่อ)
+def name_key(text):
+    text = unicodedata.normalize("NFKC", text or "").translate(ZERO_WIDTH_CHARS).casefold()
+    return " ".join(text.split())
+
+# ตำแหน่งในดัชนี = ลำดับแถวของ view อันดับรวม ผลลัพธ์จึงเรียงตามอันดับอยู่แล้ว
+class MemberSearchIndex:
+    def __init__(self, view):
+        self.names = [normalize_name(n) for n in view['name']]
+        # (คำ, ตำแหน่ง) เรียงไว้สำหรับหา prefix ด้วย bisect (ทั้งชื่อเต็มและแต่ละคำ)
+        self.tokens = sorted({ (tok, pos) for pos, name in enumerate(self.names) for tok in name.split() + [name] if tok })
+        # ตัวอักษรเดี่ยว/bigram -> ตำแหน่ง สำหรับหา substring (ชื่อไทยไม่มีช่องว่าง)
+        self.grams = defaultdict(set)
+        for pos, name in enumerate(self.names):
+            for gram in set(name) | { name[i:i + 2] for i in range(len(name) - 1) }:
+                self.grams[gram].add(pos)
+        self.by_province = self._group_positions(view['province'])
+        self.by_group = self._group_positions(view['group'])
+        self.provinces = sorted(self.by_province)
+        self.groups = sorted(g for g in self.by_group if g != "-")
+
+    @staticmethod
+    def _group_positions(col):
+        positions = defaultdict(set)
+        for pos, value in enumerate(col):
+            if isinstance(value, str): positions[value].add(pos)
+        return dict(positions)
+
+    def _prefix(self, q):
+        hits = set()
+        i = bisect.bisect_left(self.tokens, (q,))
+        while i < len(self.tokens) and self.tokens[i][0].startswith(q):
+            hits.add(self.tokens[i][1])
+            i += 1
+        return hits
+
+    def _substring(self, q):
+        grams = { q[i:i + 2] for i in range(len(q) - 1) } or { q }
+        candidates = sorted((self.grams.get(g, set()) for g in grams), key=len)
+        return { pos for pos in set.intersection(*candidates) if q in self.names[pos] }
+
+    # คืน (ตำแหน่งแถวใน view อันดับรวม ไม่เกิน limit, จำนวนที่ตรงทั้งหมด) ชื่อที่ขึ้นต้นด้วยคำค้นมาก่อน
+    def search(self, query="", province=None, group=None, limit=100):
+        q = normalize_name(query)
+        positions, prefix = None, set()
+        if q:
+            prefix = self._prefix(q)
+            positions = prefix | self._substring(q)
+        for value, index in ((province, self.by_province), (group, self.by_group)):
+            if value:
+                matched = index.get(value, set())
+                positions = matched if positions is None else positions & matched
+        if positions is None: return [], 0
+        return sorted(positions, key=lambda pos: (pos not in prefix, pos))[:limit], len(positions)
+
+@dataclass(frozen=True)
+class MemberSnapshot:
+    version: int
+    table: pd.DataFrame
+    views: RankingViews
+    search: MemberSearchIndex
+    names: frozenset # name_key ของสมาชิกทุกคน ใช้เช็คชื่อซ้ำตอนสมัคร
+
+def build_member_snapshot(version, rows):
+    table = freeze_frame(build_member_table(rows))
+    views = build_ranking_views(table)
+    names = frozenset(name_key(n) for n in table['name'])
+    return MemberSnapshot(version, table, views, MemberSearchIndex(views.normal), names)
+
+def fetch_member_snapshot():
+    version, rows = get_member_sync().refresh(get_notion_client())
+    return build_member_snapshot(version, rows)
+
+def get_member_snapshot():
+    return swr_get(RANKING_KEY, fetch_member_snapshot, lambda: build_member_snapshot(0, []))
+
+# ---------- ย่อรูปโปรไฟล์ก่อนอัปโหลด ----------
+PROFILE_IMAGE_SIZE = 512
+PROFILE_IMAGE_QUALITY = 85
+
+# ถอด EXIF (หมุนตาม Orientation ก่อน), ย่อด้านยาวไม่เกิน size (ไม่ขยาย) square=True จะ crop กลางภาพ
+# เป็นจัตุรัสก่อน แล้ว encode เป็น WebP (หรือ JPEG ถ้า Pillow ไม่มี WebP) คืน (bytes, mime) ต้องมี Pillow
+def resize_image(file_data, size, quality, square=True):
+    with Image.open(io.BytesIO(file_data)) as img:
+        img = ImageOps.exif_transpose(img)
+        if square:
+            side = min(size, img.width, img.height)
+            img = ImageOps.fit(img, (side, side), method=Image.LANCZOS)
+        else: img.thumbnail((size, size), Image.LANCZOS)
+        buf = io.BytesIO()
+        if pil_features.check("webp"):
+            img.convert("RGBA" if "A" in img.getbands() else "RGB").save(buf, format="WEBP", quality=quality, method=4)
+            return buf.getvalue(), "image/webp"
+        img.convert("RGB").save(buf, format="JPEG", quality=quality, optimize=True)
+        return buf.getvalue(), "image/jpeg"
+
+def prepare_profile_image(file_data):
+    if Image is None: return file_data, "profile.jpg"
+    try:
+        data, mime = resize_image(file_data, PROFILE_IMAGE_SIZE, PROFILE_IMAGE_QUALITY)
+        return data, "profile.webp" if mime == "image/webp" else "profile.jpg"
+    except (OSError, ValueError, Image.DecompressionBombError): return file_data, "profile.jpg"
 
 def upload_image_to_imgbb(image_file):
     url = "https://api.imgbb.com/1/upload"
     payload = { "key": IMGBB_API_KEY }
-    file_data = image_file.getvalue()
+    file_data, file_name = prepare_profile_image(image_file.getvalue())
     try:
-        response = requests.post(url, data=payload, files={'image': file_data}, timeout=20, verify=False)
+        response = requests.post(url, data=payload, files={'image': (file_name, file_data)}, timeout=20, verify=False)
         if response.status_code == 200 and response.json()['success']: return response.json()['data']['url']
     except: pass
     return None
 
+# ---------- cache รูปบน disk (รูปย่อตารางอันดับ / รูปประกอบข่าว) ----------
+# ดาวน์โหลดครั้งเดียว ย่อแล้วเก็บเป็นไฟล์ ชื่อไฟล์ = sha1 ของ key
+IMAGE_ERRORS = (requests.RequestException, OSError, ValueError) + ((Image.DecompressionBombError,) if Image else ())
+IMAGE_TIMEOUT = (5, 20)
+
+def image_data_uri(data):
+    mime = "image/webp" if data[:4] == b"RIFF" else "image/png" if data[:4] == b"\x89PNG" else "image/jpeg"
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+class ImageStore:
+    def __init__(self, directory, size, quality, square):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.size, self.quality, self.square = size, quality, square
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".img")
+
+    def load(self, key):
+        try:
+            with open(self._path(key), "rb") as f: return f.read()
+        except OSError: return None
+
+    # ดาวน์โหลด url แล้วเก็บไว้ใต้ key คืน bytes ที่เก็บ (ไม่มี Pillow เก็บไฟล์เดิมไม่ย่อ) โยน IMAGE_ERRORS
+    def store(self, key, url):
+        res = requests.get(url, timeout=IMAGE_TIMEOUT)
+        res.raise_for_status()
+        data = resize_image(res.content, self.size, self.quality, self.square)[0] if Image else res.content
+        path = self._path(key)
+        with open(path + ".tmp", "wb") as f: f.write(data)
+        os.replace(path + ".tmp", path)
+        return data
+
+# รูปย่อสำหรับตารางอันดับ: ส่งให้ตารางเป็น data URI รูปที่ยังไม่มีใน cache ใช้ URL เดิมไปก่อนและดึงใน background
+THUMB_DIR = os.path.join(os.path.dirname(DISK_CACHE_PATH) or ".", "thumbs")
+THUMB_SIZE = 96
+THUMB_QUALITY = 75
+THUMB_FETCH_WORKERS = 4
+THUMB_RETRY_AFTER = 600 # รูปที่ดึง/ย่อไม่สำเร็จ รอก่อนลองใหม่ (วินาที)
+
+class ThumbnailCache(ImageStore):
+    def __init__(self, directory):
+        super().__init__(directory, THUMB_SIZE, THUMB_QUALITY, True)
+        self.uris = {} # url -> data URI ที่อ่านจาก disk แล้ว
+        self.pending = set()
+        self.failed = {} # url -> เวลาที่ล้มเหลวล่าสุด
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=THUMB_FETCH_WORKERS, thread_name_prefix="thumb")
+
+    def _fetch(self, url):
+        try: self.store(url, url)
+        except IMAGE_ERRORS:
+            with self.lock: self.failed[url] = time.time()
+        finally:
+            with self.lock: self.pending.discard(url)
+
+    # คืน data URI ของ thumbnail ถ้ามีแล้ว ไม่งั้นคืน URL เดิมและสั่งดึงใน background
+    def get(self, url):
+        if not isinstance(url, str) or Image is None: return url
+        uri = self.uris.get(url)
+        if uri: return uri
+        data = self.load(url)
+        uri = image_data_uri(data) if data else None
+        with self.lock:
+            if uri:
+                self.uris[url] = uri
+                return uri
+            if url not in self.pending and time.time() - self.failed.get(url, 0) > THUMB_RETRY_AFTER:
+                self.pending.add(url)
+                self.executor.submit(self._fetch, url)
+        return url
+
+@st.cache_resource(show_spinner=False)
+def get_thumbnail_cache():
+    return ThumbnailCache(THUMB_DIR)
+
+# รูปประกอบข่าว: prefetch ตอนโหลดรายการข่าว popup จึงเปิดจาก disk ได้ทันที
+# key ของแต่ละรูปมาจาก parse_news_images (ไฟล์ใน Notion ใช้ path, ลิงก์ภายนอกใช้ URL เต็ม)
+# ถ้ายังไม่มีใน cache และ URL หมดอายุแล้ว ขอ URL ใหม่เฉพาะ page ข่าวนั้น (ไม่ query ทั้ง DB)
+NEWS_MEDIA_DIR = os.path.join(os.path.dirname(DISK_CACHE_PATH) or ".", "news_media")
+NEWS_MEDIA_SIZE = 1280
+NEWS_MEDIA_QUALITY = 80
+NEWS_MEDIA_WORKERS = 2
+NEWS_URL_EXPIRY_MARGIN = 120 # ถือว่าหมดอายุก่อนเวลาจริง เผื่อเวลาดาวน์โหลด (วินาที)
+
+class NewsMediaCache(ImageStore):
+    def __init__(self, directory):
+        super().__init__(directory, NEWS_MEDIA_SIZE, NEWS_MEDIA_QUALITY, False)
+        self.resigned = {} # page_id -> (urls, keys, expiry) ที่ขอใหม่หลัง URL เดิมหมดอายุ
+        self.pending = set() # page_id ที่กำลัง prefetch
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=NEWS_MEDIA_WORKERS, thread_name_prefix="news-media")
+
+    @staticmethod
+    def _valid(expiry):
+        return expiry is None or expiry - NEWS_URL_EXPIRY_MARGIN > time.time()
+
+    def _fresh_urls(self, item, notion):
+        if self._valid(item['image_expiry']): return item['image_urls'], item['image_keys']
+        with self.lock: resigned = self.resigned.get(item['id'])
+        if resigned and self._valid(resigned[2]): return resigned[0], resigned[1]
+        res = notion.get(f"pages/{item['id']}")
+        res.raise_for_status()
+        resigned = parse_news_images(res.json().get("properties", {}))
+        with self.lock: self.resigned[item['id']] = resigned
+        return resigned[0], resigned[1]
+
+    # คืนรูปของข่าวเป็น bytes (หรือ URL ที่ยังไม่หมดอายุ ถ้าดาวน์โหลดไม่ได้) เรียงตามลำดับใน Notion
+    def images(self, item, notion):
+        cached = [ self.load(key) for key in item['image_keys'] ]
+        if all(cached): return cached
+        try: urls, keys = self._fresh_urls(item, notion)
+        except requests.RequestException: return [data for data in cached if data]
+        loaded = dict(zip(item['image_keys'], cached))
+        result = []
+        for url, key in zip(urls, keys):
+            data = loaded.get(key) or self.load(key)
+            if data is None:
+                try: data = self.store(key, url)
+                except IMAGE_ERRORS: data = url
+            result.append(data)
+        return result
+
+    def _prefetch(self, item, notion):
+        try: self.images(item, notion)
+        finally:
+            with self.lock: self.pending.discard(item['id'])
+
+    def prefetch(self, items, notion):
+        for item in items:
+            if not item['image_urls']: continue
+            with self.lock:
+                if item['id'] in self.pending: continue
+                self.pending.add(item['id'])
+            self.executor.submit(self._prefetch, item, notion)
+
+@st.cache_resource(show_spinner=False)
+def get_news_media():
+    return NewsMediaCache(NEWS_MEDIA_DIR)
+
+# ใช้กับแถวที่จะแสดงเท่านั้น (top 10 / หน้าปัจจุบัน / ผลค้นหา) ไม่แตะ snapshot
+def with_thumbnails(view):
+    if view.empty: return view
+    return view.assign(photo=view['photo'].astype(object).map(get_thumbnail_cache().get))
+
+# อัปโหลดรูปใน thread แยก เก็บ Future ไว้ใน session ตาม hash ของไฟล์
+# ส่งฟอร์มซ้ำด้วยรูปเดิม (เช่นกรอกข้อมูลผิด/ชื่อซ้ำ) จึงไม่ต้องอัปโหลดใหม่
+PHOTO_UPLOAD_WORKERS = 4
+
+@st.cache_resource(show_spinner=False)
+def get_upload_executor():
+    return ThreadPoolExecutor(max_workers=PHOTO_UPLOAD_WORKERS, thread_name_prefix="upload")
+
+def start_photo_upload(image_file):
+    data = image_file.getvalue()
+    key = hashlib.sha1(data).hexdigest()
+    uploads = st.session_state.setdefault('photo_uploads', {})
+    future = uploads.get(key)
+    if future is None or (future.done() and (future.exception() or not future.result())):
+        future = uploads[key] = get_upload_executor().submit(upload_image_to_imgbb, io.BytesIO(data))
+    return future
+
 def check_login(username, password):
-    url = f"https://api.notion.com/v1/databases/{MEMBER_DB_ID}/query"
+    credentials = get_member_sync().credentials
+    user = credentials.verify(username, password)
+    if user: return user
+    # ไม่เจอใน index (สมัครใหม่/เพิ่งเปิดเครื่อง) -> ถาม Notion ส่วนรหัสไม่ตรงถามได้เป็นระยะเท่านั้น
+    if not credentials.should_recheck(username): return None
     payload = { "filter": { "and": [ { "property": "username", "formula": {"string": {"equals": username}} }, { "property": "Password", "rich_text": {"equals": password} } ] } }
     try:
-        response = requests.post(url, json=payload, headers=headers)
-        if response.status_code == 200 and response.json().get('results'): return response.json()['results'][0]
+        response = get_notion_client().post(f"databases/{MEMBER_DB_ID}/query", json=payload, priority=PRIORITY_INTERACTIVE)
+        if response.status_code == 200 and response.json().get('results'):
+            user = response.json()['results'][0]
+            credentials.put(user)
+            return user
     except: pass
     return None
 
 def check_duplicate_name(display_name):
-    url = f"https://api.notion.com/v1/databases/{MEMBER_DB_ID}/query"
     payload = { "filter": { "property": "ชื่อ", "title": { "equals": display_name } } }
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = get_notion_client().post(f"databases/{MEMBER_DB_ID}/query", json=payload, priority=PRIORITY_INTERACTIVE)
         if response.status_code == 200:
             results = response.json().get('results', [])
             return len(results) > 0
     except: pass
     return False
 
+# จองชื่อระหว่างสมัคร: กันสองคนสมัครชื่อเดียวกันพร้อมกัน และกันชื่อที่เพิ่งสมัคร
+# แต่ snapshot ยังไม่ refresh ถืออายุนานพอให้ snapshot รอบถัดไปเห็นชื่อนั้นแล้ว
+NAME_RESERVATION_TTL = 2 * SWR_TTL
+
+class NameReservations:
+    def __init__(self):
+        self.held = {} # name_key -> เวลาหมดอายุ (monotonic)
+        self.lock = threading.Lock()
+
+    def reserve(self, display_name, taken):
+        key, now = name_key(display_name), time.monotonic()
+        with self.lock:
+            if key in taken or self.held.get(key, 0) > now: return False
+            self.held = { k: t for k, t in self.held.items() if t > now }
+            self.held[key] = now + NAME_RESERVATION_TTL
+            return True
+
+    def release(self, display_name):
+        with self.lock: self.held.pop(name_key(display_name), None)
+
+@st.cache_resource(show_spinner=False)
+def get_name_reservations():
+    return NameReservations()
+
+# คืน True ถ้าจองชื่อได้ (ต้อง release_member_name เองถ้าสมัครไม่สำเร็จ)
+def reserve_member_name(display_name):
+    snapshot = get_member_snapshot()
+    # ยังไม่มีข้อมูลสมาชิกเลย (เปิดเครื่องครั้งแรกแล้วโหลดไม่สำเร็จ) -> ถาม Notion
+    if snapshot.table.empty and check_duplicate_name(display_name): return False
+    return get_name_reservations().reserve(display_name, snapshot.names)
+
+def release_member_name(display_name):
+    get_name_reservations().release(display_name)
+
 def create_new_member(display_name, email, password, birth_date, photo_url, province):
-    url = "https://api.notion.com/v1/pages"
     properties = {
         "ชื่อ": { "title": [{"text": {"content": display_name}}] },
         "Email": { "rich_text": [{"text": {"content": email}}] }, 
@@ -477,32 +1538,47 @@ def create_new_member(display_name, email, password, birth_date, photo_url, prov
     if province: properties["มาจากจังหวัด"] = { "multi_select": [{ "name": province }] }
     payload = { "parent": { "database_id": MEMBER_DB_ID }, "properties": properties }
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        response = get_notion_client().post("pages", json=payload, priority=PRIORITY_INTERACTIVE)
         if response.status_code == 200: return response.json()
         else: return None
     except: return None
 
-def get_username_from_created_page(page_id):
-    url = f"https://api.notion.com/v1/pages/{page_id}"
-    try:
-        res = requests.get(url, headers=headers)
-        if res.status_code == 200:
-            data = res.json()
-            user_formula = data["properties"].get("username", {}).get("formula", {})
-            return user_formula.get("string")
-    except: pass
-    return None
+# username มาจาก formula ของ Notion (id() = page id แบบไม่มีขีด + "@lsxrank") ปกติ response ตอนสร้างมีค่านี้มาแล้ว
+# ถ้ายังไม่มีให้สร้างจาก page id เอง แล้วให้ thread ถาม Notion ซ้ำแบบ backoff เพื่อเก็บเข้า index login (ไม่ทำให้หน้าสมัครค้าง)
+SIGNUP_POLL_DELAYS = (0.5, 1, 2, 4, 8)
+
+def username_from_page(page):
+    try: return page["properties"]["username"]["formula"]["string"] or None
+    except (KeyError, TypeError): return None
+
+def derive_username(page):
+    return username_from_page(page) or f"{notion_id(page['id'])}@lsxrank"
+
+def poll_signup_page(page_id, notion, sync):
+    for delay in SIGNUP_POLL_DELAYS:
+        time.sleep(delay)
+        try:
+            res = notion.get(f"pages/{page_id}")
+            page = res.json() if res.status_code == 200 else None
+        except requests.RequestException: page = None
+        if page and username_from_page(page):
+            sync.credentials.put(page)
+            return
+
+def start_signup_followup(page, notion, sync):
+    if username_from_page(page):
+        sync.credentials.put(page) # login ครั้งแรกไม่ต้องถาม Notion
+        return
+    threading.Thread(target=poll_signup_page, args=(page["id"], notion, sync), daemon=True).start()
 
 def get_user_by_id(page_id):
-    url = f"https://api.notion.com/v1/pages/{page_id}"
     try:
-        res = requests.get(url, headers=headers)
+        res = get_notion_client().get(f"pages/{page_id}", priority=PRIORITY_INTERACTIVE)
         if res.status_code == 200: return res.json()
     except: pass
     return None
 
 def update_member_info(page_id, new_display_name, new_photo_url, new_password, new_birthday, new_province):
-    url = f"https://api.notion.com/v1/pages/{page_id}"
     properties = {}
     if new_display_name: properties["ชื่อ"] = {"title": [{"text": {"content": new_display_name}}]}
     if new_password: properties["Password"] = {"rich_text": [{"text": {"content": new_password}}]}
@@ -510,7 +1586,109 @@ def update_member_info(page_id, new_display_name, new_photo_url, new_password, n
     if new_birthday: properties["วันเกิด"] = { "date": {"start": new_birthday.strftime("%Y-%m-%d")} }
     if new_province: properties["มาจากจังหวัด"] = { "multi_select": [{ "name": new_province }] }
     if not properties: return True
-    return requests.patch(url, json={"properties": properties}, headers=headers).status_code == 200
+    res = get_notion_client().patch(f"pages/{page_id}", json={"properties": properties}, priority=PRIORITY_INTERACTIVE)
+    if res.status_code != 200: return False
+    # อัปเดต index login ทันที ไม่ให้รหัสเก่ายังใช้ได้จนถึง sync รอบหน้า
+    get_member_sync().credentials.put(res.json())
+    return True
+
+# ================= UI HELPERS =================
+# บอกอายุข้อมูลที่กำลังแสดง (มาจาก SWR cache)
+def show_freshness(key):
+    swr = get_swr_cache()
+    age = swr.age(key)
+    if age is None: return
+    # ChangeWatcher ยืนยันล่าสุดว่า Notion ยังไม่มีอะไรเปลี่ยน -> ข้อมูลยังใหม่อยู่ถึงตอนนั้น
+    # (ไม่ใช้กับค่าเก่าที่เพิ่งโหลดจาก disk ตอนเปิดเครื่อง)
+    checked = get_change_watcher().checked_age()
+    if checked is not None and age < SWR_TTL and not swr.is_expired(key): age = min(age, checked)
+    if age < 60: age_text = "เมื่อสักครู่"
+    elif age < 3600: age_text = f"{int(age // 60)} นาทีที่แล้ว"
+    elif age < 86400: age_text = f"{int(age // 3600)} ชั่วโมงที่แล้ว"
+    else: age_text = f"{int(age // 86400)} วันที่แล้ว"
+    refreshing = " · 🔄 กำลังอัปเดต..." if swr.is_refreshing(key) else ""
+    st.caption(f"🕒 อัปเดต{age_text}{refreshing}")
+
+# ตารางอันดับแบบแบ่งหน้า: ตัดเฉพาะหน้าที่ดูอยู่จาก view ที่เรียงไว้แล้ว ส่งไป browser แค่นั้น
+LEADERBOARD_PAGE_SIZES = [25, 50, 100]
+
+# view อาจไม่ได้เรียงตาม rank_col (Junior เรียงตามคะแนน) จึงหาแถวที่อันดับตรงก่อน
+# ไม่เจอค่อยเอาแถวที่อันดับใกล้ที่สุด ข้ามแถวที่ไม่มีอันดับ (9999)
+def find_rank_position(view, rank_col, rank):
+    ranks = view[rank_col].to_numpy()
+    hits = (ranks == rank).nonzero()[0]
+    if len(hits): return int(hits[0])
+    ranked = (ranks != 9999).nonzero()[0]
+    if not len(ranked): return len(view) - 1
+    return int(ranked[abs(ranks[ranked].astype("int64") - rank).argmin()])
+
+def find_member_position(view, member_id):
+    hits = (view['id'] == member_id).to_numpy().nonzero()[0]
+    return int(hits[0]) if len(hits) else None
+
+def show_paginated_table(view, key, rank_col, column_order, column_config, height=600):
+    total = len(view)
+    size_key, page_key, jump_key = f"{key}_size", f"{key}_page", f"{key}_jump"
+    if size_key not in st.session_state: st.session_state[size_key] = LEADERBOARD_PAGE_SIZES[0]
+    page_size = st.session_state[size_key]
+    pages = max(1, -(-total // page_size))
+    st.session_state[page_key] = min(max(1, st.session_state.get(page_key, 1)), pages)
+
+    def go_to(position):
+        st.session_state[page_key] = position // st.session_state[size_key] + 1
+
+    def jump_to_rank():
+        if st.session_state[jump_key]: go_to(find_rank_position(view, rank_col, st.session_state[jump_key]))
+
+    my_id = st.session_state['user_page']['id'] if st.session_state.get('user_page') else None
+    my_position = find_member_position(view, my_id) if my_id else None
+
+    c1, c2, c3, c4 = st.columns(4)
+    with c1: st.selectbox("แถวต่อหน้า", LEADERBOARD_PAGE_SIZES, key=size_key, on_change=lambda: st.session_state.update({page_key: 1}))
+    with c2: st.number_input(f"หน้า (จาก {pages})", min_value=1, max_value=pages, step=1, key=page_key)
+    with c3: st.number_input("ไปที่อันดับ", min_value=1, step=1, value=None, key=jump_key, on_change=jump_to_rank)
+    with c4:
+        st.write("")
+        st.button("📍 อันดับของฉัน", key=f"{key}_me", disabled=my_position is None,
+                  on_click=lambda: go_to(my_position), use_container_width=True)
+
+    start = (st.session_state[page_key] - 1) * page_size
+    st.dataframe(with_thumbnails(view.iloc[start:start + page_size]), column_order=column_order, column_config=column_config,
+                 hide_index=True, use_container_width=True, height=height)
+    if total: st.caption(f"แสดงลำดับที่ {start + 1}–{min(start + page_size, total)} จากทั้งหมด {total} คน")
+
+# feed ข่าวทีละหน้าจาก news store กด "โหลดเพิ่ม" เพื่อต่อหน้าถัดไป
+# (badge_color=None ให้สีตามประเภทข่าว)
+def show_news_feed(category_filter, key, empty_text, badge_color=None):
+    pages_key = f"{key}_pages"
+    pages = st.session_state.setdefault(pages_key, 1)
+    show_freshness(NEWS_KEY)
+    cursor, shown = None, 0
+    for _ in range(pages):
+        news_page = get_news_page(category_filter, cursor)
+        for item in news_page.items:
+            with st.container(border=True):
+                c_head, c_cat = st.columns([3, 1])
+                with c_head: st.markdown(f"### {item['topic']}")
+                with c_cat:
+                    cat_color = badge_color or "#808080"
+                    if not badge_color and "ประกาศ" in item['category']: cat_color = "#FF4B4B"
+                    elif not badge_color and "กฎ" in item['category']: cat_color = "#2E86C1"
+                    st.markdown(f"<div style='text-align:right;'><span style='background-color:{cat_color}; padding: 4px 10px; border-radius: 5px; color: white;'>{item['category']}</span></div>", unsafe_allow_html=True)
+                
+                st.caption(f"🗓️ วันที่ประกาศ: {item['date']}")
+                st.markdown("---")
+                st.write(item['preview'])
+                
+                if st.button("📖 อ่านเนื้อหาฉบับเต็ม", key=f"{key}_full_{item['id']}"):
+                    show_news_popup(item)
+        shown += len(news_page.items)
+        cursor = news_page.next_cursor
+        if not cursor: break
+    if not shown: st.info(empty_text)
+    elif cursor:
+        st.button("⬇️ โหลดเพิ่ม", key=f"{key}_more", use_container_width=True,
+                  on_click=lambda: st.session_state.update({pages_key: pages + 1}))
 
 # ================= GLOBAL DIALOGS =================
 @st.dialog("📰 รายละเอียด")
@@ -522,10 +1700,11 @@ def show_news_popup(item):
     else: cat_style = "color: gray;"
     st.markdown(f"🗓️ {item['date']} | 🏷️ <span style='{cat_style}'>{item['category']}</span>", unsafe_allow_html=True)
     st.markdown("---")
-    if item['image_urls']:
-        st.image(item['image_urls'], use_container_width=True)
-        if len(item['image_urls']) > 1:
-             st.caption(f"ทั้งหมด {len(item['image_urls'])} รูปภาพ")
+    images = get_news_media().images(item, get_notion_client()) if item['image_urls'] else []
+    if images:
+        st.image(images, use_container_width=True)
+        if len(images) > 1:
+             st.caption(f"ทั้งหมด {len(images)} รูปภาพ")
         st.write("")
     st.write(item['content'])
     if item['url']:
@@ -614,20 +1793,17 @@ if st.session_state['selected_menu'] == "🏠 หน้าแรก (Dashboard)"
         tab_top_main, tab_top_jr = st.tabs(["🏆 Top 10 Players", "👶 Top 10 Junior (<=13 ปี)"])
         
         with st.spinner("โหลดอันดับ..."):
-            df_dash = get_ranking_dataframe()
+            views = get_member_snapshot().views
+            show_freshness(RANKING_KEY)
             
             # --- TAB 1: Normal Top 10 ---
             with tab_top_main:
                 st.subheader("🏆 Top 10 Players")
-                if not df_dash.empty:
-                    # ✅ เรียง Normal: อันดับ Rank SS2 (น้อย->มาก), ชื่อ (ก->ฮ)
-                    df_normal = df_dash.sort_values(by=["rank_num", "name"], ascending=[True, True]).reset_index(drop=True)
-                    df_top10 = df_normal.head(10)
-                    
-                    st.dataframe(df_top10[['อันดับ', 'photo', 'name', 'score', 'group']],
+                if not views.empty:
+                    st.dataframe(with_thumbnails(views.top_normal), column_order=['rank_num', 'photo', 'name', 'score', 'group'],
                         column_config={ 
                             "photo": st.column_config.ImageColumn("รูป", width="small"), 
-                            "อันดับ": st.column_config.NumberColumn("Rank", format="%d"), 
+                            "rank_num": st.column_config.NumberColumn("Rank", format="%d"), 
                             "name": st.column_config.TextColumn("Player"), 
                             "score": st.column_config.NumberColumn("Score", format="%d ⭐"), 
                             "group": st.column_config.TextColumn("Group") 
@@ -638,19 +1814,12 @@ if st.session_state['selected_menu'] == "🏠 หน้าแรก (Dashboard)"
             # --- TAB 2: Junior Top 10 ---
             with tab_top_jr:
                 st.subheader("👶 Top 10 Junior")
-                if not df_dash.empty:
-                    # ✅ กรองอายุ <= 13 (ใช้คอลัมน์ age)
-                    df_jr = df_dash[df_dash['age'] <= 13].copy()
-                    
-                    if not df_jr.empty:
-                        # ✅ เรียง Junior: คะแนน Junior (มาก->น้อย), ชื่อ (ก->ฮ)
-                        df_jr = df_jr.sort_values(by=["score_jr", "name"], ascending=[False, True]).reset_index(drop=True)
-                        df_top10_jr = df_jr.head(10)
-                        
-                        st.dataframe(df_top10_jr[['อันดับ Junior', 'photo', 'name', 'score_jr', 'age']],
+                if not views.empty:
+                    if not views.junior.empty:
+                        st.dataframe(with_thumbnails(views.top_junior), column_order=['rank_jr_num', 'photo', 'name', 'score_jr', 'age'],
                             column_config={ 
                                 "photo": st.column_config.ImageColumn("รูป", width="small"), 
-                                "อันดับ Junior": st.column_config.NumberColumn("อันดับ Jr.", format="%d"), 
+                                "rank_jr_num": st.column_config.NumberColumn("อันดับ Jr.", format="%d"), 
                                 "name": st.column_config.TextColumn("Player"), 
                                 "score_jr": st.column_config.NumberColumn("Score Jr.", format="%d 🍼"),
                                 "age": st.column_config.NumberColumn("อายุ", format="%d ปี")
@@ -665,23 +1834,19 @@ if st.session_state['selected_menu'] == "🏠 หน้าแรก (Dashboard)"
         st.subheader("📅 กิจกรรมถัดไป")
         with st.spinner("กำลังโหลดกิจกรรมถัดไป..."):
             next_event = get_upcoming_event()
+            show_freshness(PROJECT_KEY)
             if next_event:
                 with st.container(border=True):
                     if next_event['url']: st.markdown(f"### [{next_event['title']}]({next_event['url']})")
                     else: st.markdown(f"### {next_event['title']}")
                     
-                    try:
-                        d_obj = datetime.strptime(next_event['date'], "%Y-%m-%d").date()
-                        d_nice = d_obj.strftime("%d %b %Y")
-                        today = get_thai_date()
-                        days_left = (d_obj - today).days
-                    except: d_nice = next_event['date']; days_left = 99
-                    
-                    st.write(f"🗓️ **วันที่:** {d_nice}")
+                    days_left = next_event['days_left']
+                    st.write(f"🗓️ **วันที่:** {next_event['date']}")
                     st.write(f"🏷️ **ประเภท:** {next_event['type']}")
                     
                     if days_left == 0: st.error("🔥 วันนี้!")
-                    elif days_left > 0: st.info(f"⏳ อีก {days_left} วัน")
+                    elif days_left < 0: st.error("🔥 กำลังจัดอยู่!")
+                    else: st.info(f"⏳ อีก {days_left} วัน")
                     
                     # ✅ ปุ่มรายละเอียดเพิ่มเติม
                     c1, c2 = st.columns(2)
@@ -709,7 +1874,8 @@ if st.session_state['selected_menu'] == "🏠 หน้าแรก (Dashboard)"
     st.write("---")
     st.subheader("📢 ประกาศล่าสุด")
     with st.spinner("กำลังโหลดข่าว..."):
-        news_items = get_latest_news(limit=1)
+        news_items = get_news_page().items[:1]
+        show_freshness(NEWS_KEY)
         if news_items:
             for item in news_items:
                 with st.container(border=True):
@@ -719,8 +1885,7 @@ if st.session_state['selected_menu'] == "🏠 หน้าแรก (Dashboard)"
                     elif "กฎ" in item['category']: cat_color = "#2E86C1"
                     st.markdown(f"<span style='color:{cat_color}; font-size:12px;'>🏷️ {item['category']}</span>", unsafe_allow_html=True)
                     
-                    short_content = (item['content'][:150] + '...') if len(item['content']) > 150 else item['content']
-                    st.write(short_content)
+                    st.write(item['preview'])
                     st.caption(f"🗓️ {item['date']}")
                     
                     c1, c2 = st.columns(2)
@@ -736,49 +1901,61 @@ elif st.session_state['selected_menu'] == "🏆 ตารางอันดั
     st.header("🏆 Leaderboard")
     
     with st.spinner("กำลังโหลดข้อมูลอันดับ..."):
-        df_leaderboard = get_ranking_dataframe()
+        snapshot = get_member_snapshot()
+        views = snapshot.views
+    show_freshness(RANKING_KEY)
         
-    if not df_leaderboard.empty:
+    if not views.empty:
+        # 🔎 ค้นหาผู้เล่น (ใช้ดัชนีที่สร้างไว้แล้ว ไม่ scan ตารางใหม่)
+        s1, s2, s3 = st.columns([2, 1, 1])
+        with s1: search_q = st.text_input("🔎 ค้นหาผู้เล่น", placeholder="พิมพ์ชื่อ...", key="lb_search")
+        with s2: search_prov = st.selectbox("จังหวัด", snapshot.search.provinces, index=None, placeholder="ทุกจังหวัด", key="lb_search_prov")
+        with s3: search_group = st.selectbox("Rank Group", snapshot.search.groups, index=None, placeholder="ทุกกลุ่ม", key="lb_search_group")
+        if search_q or search_prov or search_group:
+            hits, total = snapshot.search.search(search_q, search_prov, search_group)
+            if hits:
+                st.dataframe(with_thumbnails(views.normal.iloc[hits]), column_order=['rank_num', 'photo', 'name', 'score', 'group', 'province'],
+                    column_config={ 
+                        "photo": st.column_config.ImageColumn("รูปโปรไฟล์"), 
+                        "rank_num": st.column_config.NumberColumn("อันดับ", format="%d"), 
+                        "name": st.column_config.TextColumn("ชื่อสมาชิก"), 
+                        "score": st.column_config.NumberColumn("คะแนนรวม", format="%d ⭐"), 
+                        "group": st.column_config.TextColumn("Rank Group"), 
+                        "province": st.column_config.TextColumn("จังหวัด") 
+                    },
+                    hide_index=True, use_container_width=True)
+                st.caption(f"พบ {total} คน" + (f" (แสดง {len(hits)} คนแรก)" if total > len(hits) else ""))
+            else: st.info("ไม่พบผู้เล่นที่ค้นหา")
+            st.markdown("---")
+
         # ✅ สร้าง Tabs แยกประเภท
         tab_lb_main, tab_lb_jr = st.tabs(["🏆 อันดับรวม (Normal)", "👶 อันดับ Junior (<=13 ปี)"])
         
         # --- TAB 1: Normal Rank ---
         with tab_lb_main:
             st.subheader("🏆 ตารางอันดับรวม")
-            # ✅ เรียง Normal: อันดับ Rank SS2 (น้อย->มาก), ชื่อ (ก->ฮ)
-            df_main = df_leaderboard.sort_values(by=["rank_num", "name"], ascending=[True, True]).reset_index(drop=True)
-            
-            st.dataframe(df_main[['อันดับ', 'photo', 'name', 'score', 'group', 'title']],
-                column_config={ 
+            show_paginated_table(views.normal, "lb_main", "rank_num", ['rank_num', 'photo', 'name', 'score', 'group', 'title'],
+                { 
                     "photo": st.column_config.ImageColumn("รูปโปรไฟล์"), 
-                    "อันดับ": st.column_config.NumberColumn("อันดับ", format="%d"), 
+                    "rank_num": st.column_config.NumberColumn("อันดับ", format="%d"), 
                     "name": st.column_config.TextColumn("ชื่อสมาชิก"), 
                     "score": st.column_config.NumberColumn("คะแนนรวม", format="%d ⭐"), 
                     "group": st.column_config.TextColumn("Rank Group"), 
                     "title": st.column_config.TextColumn("Rank Title") 
-                },
-                hide_index=True, use_container_width=True, height=600)
+                })
 
         # --- TAB 2: Junior Rank ---
         with tab_lb_jr:
             st.subheader("👶 ตารางอันดับ Junior")
-            
-            # ✅ กรองเฉพาะอายุ <= 13 ปี
-            df_jr = df_leaderboard[df_leaderboard['age'] <= 13].copy()
-            
-            if not df_jr.empty:
-                # ✅ เรียง Junior: คะแนน Junior (มาก->น้อย) -> ชื่อ (ก->ฮ)
-                df_jr = df_jr.sort_values(by=["score_jr", "name"], ascending=[False, True]).reset_index(drop=True)
-                
-                st.dataframe(df_jr[['อันดับ Junior', 'photo', 'name', 'score_jr', 'age']],
-                    column_config={ 
+            if not views.junior.empty:
+                show_paginated_table(views.junior, "lb_jr", "rank_jr_num", ['rank_jr_num', 'photo', 'name', 'score_jr', 'age'],
+                    { 
                         "photo": st.column_config.ImageColumn("รูปโปรไฟล์"), 
-                        "อันดับ Junior": st.column_config.NumberColumn("อันดับ Jr.", format="%d"), 
+                        "rank_jr_num": st.column_config.NumberColumn("อันดับ Jr.", format="%d"), 
                         "name": st.column_config.TextColumn("ชื่อสมาชิก"), 
                         "score_jr": st.column_config.NumberColumn("คะแนน Jr.", format="%d 🍼"),
                         "age": st.column_config.NumberColumn("อายุ", format="%d ปี")
-                    },
-                    hide_index=True, use_container_width=True, height=600)
+                    })
             else:
                 st.info("ยังไม่มีข้อมูลผู้เล่นรุ่น Junior (อายุไม่เกิน 13 ปี)")
 
@@ -788,68 +1965,41 @@ elif st.session_state['selected_menu'] == "🏆 ตารางอันดั
 elif st.session_state['selected_menu'] == "📢 ประกาศ/ข่าวสาร":
     st.subheader("📢 ประกาศและข่าวสารทั้งหมด")
     with st.spinner("กำลังโหลดข่าวสาร..."):
-        all_news = get_latest_news(limit=50)
-        if all_news:
-            for item in all_news:
-                with st.container(border=True):
-                    c_head, c_cat = st.columns([3, 1])
-                    with c_head: st.markdown(f"### {item['topic']}")
-                    with c_cat:
-                        cat_color = "#808080"
-                        if "ประกาศ" in item['category']: cat_color = "#FF4B4B"
-                        elif "กฎ" in item['category']: cat_color = "#2E86C1"
-                        st.markdown(f"<div style='text-align:right;'><span style='background-color:{cat_color}; padding: 4px 10px; border-radius: 5px; color: white;'>{item['category']}</span></div>", unsafe_allow_html=True)
-                    
-                    st.caption(f"🗓️ วันที่ประกาศ: {item['date']}")
-                    st.markdown("---")
-                    
-                    short_content = (item['content'][:200] + '...') if len(item['content']) > 200 else item['content']
-                    st.write(short_content)
-                    
-                    if st.button("📖 อ่านเนื้อหาฉบับเต็ม", key=f"news_full_{item['id']}"):
-                        show_news_popup(item)
-
-        else: st.info("ยังไม่มีประกาศ")
+        show_news_feed(None, "news", "ยังไม่มีประกาศ")
 
 # 📜 PAGE: RULES (NEW)
 elif st.session_state['selected_menu'] == "📜 กฎระเบียบและข้อบังคับ":
     st.subheader("📜 กฎระเบียบและข้อบังคับ")
     with st.spinner("กำลังโหลดกฎระเบียบ..."):
-        rules_news = get_latest_news(limit=100, category_filter="กฎ")
-        if rules_news:
-            for item in rules_news:
-                with st.container(border=True):
-                    c_head, c_cat = st.columns([3, 1])
-                    with c_head: st.markdown(f"### {item['topic']}")
-                    with c_cat:
-                        st.markdown(f"<div style='text-align:right;'><span style='background-color:#2E86C1; padding: 4px 10px; border-radius: 5px; color: white;'>{item['category']}</span></div>", unsafe_allow_html=True)
-                    
-                    st.caption(f"🗓️ วันที่ประกาศ: {item['date']}")
-                    st.markdown("---")
-                    
-                    short_content = (item['content'][:200] + '...') if len(item['content']) > 200 else item['content']
-                    st.write(short_content)
-                    
-                    if st.button("📖 อ่านเนื้อหาฉบับเต็ม", key=f"rule_full_{item['id']}"):
-                        show_news_popup(item)
-        else: st.info("ยังไม่มีข้อมูลกฎระเบียบ")
+        show_news_feed("กฎ", "rule", "ยังไม่มีข้อมูลกฎระเบียบ", badge_color="#2E86C1")
 
 # 📅 PAGE: CALENDAR
 elif st.session_state['selected_menu'] == "📅 ปฏิทินกิจกรรม":
-    st.subheader("📅 ปฏิทินกิจกรรม (ม.ค. - มี.ค. 2026)")
+    st.subheader("📅 ปฏิทินกิจกรรม")
+
+    # เลื่อนเดือนด้วยปุ่มของแอป (component ไม่ส่งช่วงวันที่ที่ปฏิทินแสดงกลับมา) แล้วโหลดเฉพาะช่วงนั้น
+    if 'calendar_month' not in st.session_state: st.session_state['calendar_month'] = get_thai_date().replace(day=1)
+    n1, n2, n3 = st.columns(3)
+    with n1: st.button("◀️ เดือนก่อน", use_container_width=True,
+                       on_click=lambda: st.session_state.update(calendar_month=prev_month(st.session_state['calendar_month'])))
+    with n2: st.button("📍 เดือนนี้", use_container_width=True,
+                       on_click=lambda: st.session_state.update(calendar_month=get_thai_date().replace(day=1)))
+    with n3: st.button("เดือนถัดไป ▶️", use_container_width=True,
+                       on_click=lambda: st.session_state.update(calendar_month=next_month(st.session_state['calendar_month'])))
+    cal_month = st.session_state['calendar_month']
     
     with st.spinner("กำลังโหลดปฏิทิน..."): 
-        events = get_calendar_events()
+        events = get_calendar_events(*calendar_range(cal_month))
     
     calendar_options = { 
-        "headerToolbar": { "left": "today prev,next", "center": "title", "right": "dayGridMonth,listMonth" }, 
-        "initialDate": "2026-01-01", 
+        "headerToolbar": { "left": "", "center": "title", "right": "dayGridMonth,listMonth" }, 
+        "initialDate": cal_month.isoformat(), 
         "initialView": "dayGridMonth",
         "height": 750,
     }
     
     try:
-        cal_key = f"cal_force_{st.session_state.get('calendar_force_key', 'default')}"
+        cal_key = f"cal_force_{st.session_state.get('calendar_force_key', 'default')}_{cal_month.isoformat()}"
         cal_data = calendar(events=events, options=calendar_options, callbacks=['eventClick'], key=cal_key)
         
         if cal_data.get("callback") == "eventClick":
@@ -940,27 +2090,31 @@ elif st.session_state['selected_menu'] == "🔐 ระบบสมาชิก /
                     elif reg_pass != reg_confirm_pass: st.error("รหัสผ่านไม่ตรงกัน")
                     elif not reg_photo: st.error("กรุณาอัปโหลดรูปโปรไฟล์")
                     else:
+                        # ฟอร์มผ่านแล้วค่อยเริ่มอัปโหลดรูป คู่ขนานกับการเช็คชื่อ ถ้าชื่อซ้ำแล้วส่งใหม่จะใช้รูปที่อัปโหลดแล้ว
+                        photo_upload = start_photo_upload(reg_photo)
                         with st.spinner("กำลังตรวจสอบชื่อ..."):
-                            if check_duplicate_name(reg_display_name): st.error("ชื่อนี้มีผู้ใช้งานแล้ว")
-                            else:
+                            name_reserved = reserve_member_name(reg_display_name)
+                        if not name_reserved: st.error("ชื่อนี้มีผู้ใช้งานแล้ว")
+                        else:
+                            new_user = None
+                            try:
                                 with st.spinner("กำลังอัปโหลดรูป..."):
-                                    url = upload_image_to_imgbb(reg_photo)
+                                    url = None if photo_upload.exception() else photo_upload.result()
                                     if url:
                                         with st.spinner("กำลังสร้างบัญชี..."):
                                             new_user = create_new_member(reg_display_name, reg_email, reg_pass, reg_birthday, url, reg_province)
                                             if new_user:
-                                                real_user = None
-                                                try: real_user = new_user["properties"]["username"]["formula"]["string"]
-                                                except: pass
-                                                if not real_user:
-                                                    time.sleep(1); real_user = get_username_from_created_page(new_user['id'])
-                                                if not real_user: real_user = f"{new_user['id']}@lsxrank"
+                                                real_user = derive_username(new_user)
+                                                start_signup_followup(new_user, get_notion_client(), get_member_sync())
                                                 st.success("🎉 สมัครสมาชิกสำเร็จ!")
                                                 st.balloons()
                                                 st.success(f"Username: **{real_user}**")
                                                 st.code(real_user)
                                                 st.warning("จดจำ Username ไว้ใช้ Login ครั้งต่อไป")
                                     else: st.error("อัปโหลดรูปไม่สำเร็จ")
+                            finally:
+                                # สมัครสำเร็จแล้วถือชื่อไว้จนหมดอายุ ไม่สำเร็จคืนชื่อทันที
+                                if not new_user: release_member_name(reg_display_name)
 
     # Login Success -> Profile Page
     else:
@@ -1017,6 +2171,13 @@ elif st.session_state['selected_menu'] == "🔐 ระบบสมาชิก /
         try: user_age = extract_numeric(props.get("อายุ"))
         except: pass
         
+        # ประวัติการลง Rank: ดึงชื่อทั้งสองรายการในรอบเดียว
+        try: r_ids = [r['id'] for r in props.get("สถิติการลง Rank ทั้งหมด", {}).get("relation", [])]
+        except: r_ids = []
+        try: r_jr_ids = [r['id'] for r in props.get("สถิติการลง Rank Junior ทั้งหมด", {}).get("relation", [])]
+        except: r_jr_ids = [] 
+        history_titles = resolve_page_titles(r_ids + r_jr_ids) if (r_ids or r_jr_ids) else {}
+        
         col1, col2 = st.columns([1, 2])
         with col1:
             st.image(current_photo, width=150)
@@ -1062,11 +2223,9 @@ elif st.session_state['selected_menu'] == "🔐 ระบบสมาชิก /
                 st.caption(f"{stats_str} งาน")
 
                 st.subheader("📜 Rank History (Normal)")
-                try: r_ids = [r['id'] for r in props.get("สถิติการลง Rank ทั้งหมด", {}).get("relation", [])]
-                except: r_ids = []
                 if r_ids:
                     with st.container(height=200):
-                        for i in r_ids: st.write(f"• {get_page_title(i)}")
+                        for i in r_ids: st.write(f"• {history_titles[i]}")
                 else: st.info("-")
 
             # Tab 2: Junior Rank (NEW)
@@ -1082,12 +2241,9 @@ elif st.session_state['selected_menu'] == "🔐 ระบบสมาชิก /
                 
                 st.markdown("---")
                 st.subheader("📜 Rank History (Junior)")
-                try: r_jr_ids = [r['id'] for r in props.get("สถิติการลง Rank Junior ทั้งหมด", {}).get("relation", [])]
-                except: r_jr_ids = [] 
-                
                 if r_jr_ids:
                     with st.container(height=200):
-                        for i in r_jr_ids: st.write(f"• {get_page_title(i)}")
+                        for i in r_jr_ids: st.write(f"• {history_titles[i]}")
                 else: st.info("ไม่มีประวัติการแข่ง Junior")
 
             # Tab 3: Edit Profile